@@ -0,0 +1,613 @@
+"""
+Classroom load scenario.
+
+Models a lab session: a professor registers, opens a classroom and publishes
+a few programs, then --students students arrive over --ramp seconds. Each
+student registers with /register, lists the classroom's programs and reads
+a summary. Then, until --duration seconds have passed, they repeat a cycle:
+work on their code, ask the tutor a few questions (/chat/message), submit
+(/submissions) and answer the quiz they get back (/quiz/mark). Think times
+are random (exponential) around the --think-* means. --speed compresses
+the whole session, e.g. --speed 10 plays 300 seconds in 30.
+
+While the session runs, /metrics is sampled every --sample-interval seconds
+to find what saturates first: requests in flight against --capacity (web
+workers * threads), the database pool, the judge and submission queues and
+the speech synthesizer pools. If DB_URL is set, the Postgres connections of
+all workers are counted from pg_stat_activity as well; under gunicorn the
+pool gauges only come from the worker that served the scrape. The report
+gives client latencies per action, the peak of each of these, and the mean
+latency of the database, LLM, speech and Judge0 calls during the session.
+
+Point --url at a running server, or pass --spawn to start one with
+`bench/fakes.py --app` (gunicorn against the fake OpenAI, Judge0 and speech)
+for the duration of the run, with the LLM and Judge0 caches off unless
+--caches is given. The classroom is deleted afterwards if DB_URL is set.
+
+Usage, from the server folder:
+
+    python bench/classroom.py --spawn [--students 60] [--duration 300]
+        [--speed 1] [--capacity 32] [--output session.json]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import signal
+import argparse
+import threading
+import subprocess
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, SERVER_DIR)
+
+from endpoints import PROGRAM_CODE, cleanup, percentile  # noqa: E402
+
+PASSWORD = "bench-password"
+QUIZ_OPTIONS = "ABCD"
+QUESTIONS = [
+    "Why does my loop stop one step early?",
+    "What does scanf return?",
+    "How do I print a number with printf?",
+    "Why do I get a compilation error on this line?",
+    "What is the difference between = and ==?",
+]
+# Histograms whose mean during the session is reported, by dependency
+DEPENDENCIES = {
+    "db": "db_query_duration_seconds",
+    "llm": "llm_request_duration_seconds",
+    "speech": "speech_request_duration_seconds",
+    "judge": "judge_request_duration_seconds",
+}
+
+
+class Recorder:
+    """Latencies and errors of the client actions, by action name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(list)
+        self._sessions = []
+
+    def session(self):
+        """A new client session, closed by close()."""
+        session = requests.Session()
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def close(self):
+        # Idle keep-alive connections would hold up the server's shutdown
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+
+    def call(self, session, action, method, url, **kwargs):
+        """Sends one request and records it. Returns the JSON body, or None on failure."""
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=300, **kwargs)
+            ok = response.status_code < 400
+            detail = f"{response.status_code} {response.text[:200]}"
+        except requests.RequestException as e:
+            response, ok, detail = None, False, str(e)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if ok:
+                self.latencies[action].append(elapsed)
+            else:
+                self.errors[action].append(detail)
+        if not ok:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def summary(self, wall):
+        actions = sorted(set(self.latencies) | set(self.errors))
+        result = {}
+        for action in actions:
+            latencies = sorted(self.latencies[action])
+            errors = self.errors[action]
+            result[action] = {
+                "requests": len(latencies) + len(errors),
+                "errors": len(errors),
+                "first_error": errors[0] if errors else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "rps": len(latencies) / wall if wall else None,
+            }
+        return result
+
+
+def _user_id(body):
+    # /register returns the inserted row as user_id
+    value = (body or {}).get("user_id")
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def setup_classroom(base_url, recorder, programs, tag):
+    """Registers a professor, opens a classroom and publishes the programs."""
+    session = recorder.session()
+    professor = _user_id(
+        recorder.call(
+            session,
+            "register",
+            "POST",
+            f"{base_url}/register",
+            json={"username": f"lab_{tag}_prof", "password": PASSWORD, "role": "professor"},
+        )
+    )
+    if professor is None:
+        raise SystemExit(f"Could not register the professor: {recorder.errors['register'][-1]}")
+    class_id = recorder.call(
+        session,
+        "create_classroom",
+        "POST",
+        f"{base_url}/classrooms",
+        json={"name": f"Lab {tag}", "professor_id": professor},
+    )["id"]
+    program_ids = []
+    for i in range(programs):
+        # Also generates the summaries in every language
+        body = recorder.call(
+            session,
+            "create_program",
+            "POST",
+            f"{base_url}/programs",
+            json={
+                "title": f"Lab {tag} exercise {i + 1}",
+                "description": "Read two numbers and print their sum",
+                "code": PROGRAM_CODE,
+                "class_id": class_id,
+            },
+        )
+        if body and "id" in body:
+            program_ids.append(body["id"])
+    if not program_ids:
+        raise SystemExit(f"Could not create programs: {recorder.errors['create_program'][-1]}")
+    return {"class_id": class_id, "professor": professor, "programs": program_ids}
+
+
+def student(index, args, base_url, classroom, recorder, deadline, registered, tag):
+    """One student's session, see the module docstring."""
+    rng = random.Random(f"{tag}-{index}")
+    session = recorder.session()
+
+    def think(mean):
+        # Never sleeps past the end of the session
+        pause = rng.expovariate(1 / mean) / args.speed if mean > 0 else 0
+        time.sleep(max(min(pause, deadline - time.monotonic()), 0))
+        return time.monotonic() < deadline
+
+    time.sleep(rng.uniform(0, args.ramp) / args.speed)
+    user_id = _user_id(
+        recorder.call(
+            session,
+            "register",
+            "POST",
+            f"{base_url}/register",
+            json={
+                "username": f"lab_{tag}_student_{index}",
+                "password": PASSWORD,
+                "role": "student",
+                "class_id": classroom["class_id"],
+            },
+        )
+    )
+    if user_id is None:
+        return
+    registered.append(user_id)
+
+    programs = recorder.call(
+        session, "list_programs", "GET", f"{base_url}/programs/classroom/{classroom['class_id']}"
+    )
+    program_ids = [program["id"] for program in programs or []] or classroom["programs"]
+    program_id = rng.choice(program_ids)
+    recorder.call(session, "summaries", "GET", f"{base_url}/summaries/program/{program_id}")
+
+    while think(args.think_code):
+        for _ in range(rng.randint(0, 2 * args.chats)):
+            recorder.call(
+                session,
+                "chat_message",
+                "POST",
+                f"{base_url}/chat/message",
+                json={
+                    "user_id": user_id,
+                    "program_id": program_id,
+                    "text": rng.choice(QUESTIONS),
+                    "language": "en",
+                },
+            )
+            if not think(args.think_chat):
+                return
+
+        result = recorder.call(
+            session,
+            "submit",
+            "POST",
+            f"{base_url}/submissions",
+            json={
+                "user_id": user_id,
+                "program_id": program_id,
+                "code": PROGRAM_CODE,
+                "language_id": 50,
+                "quiz_language": "en",
+            },
+        )
+        if not result or not result.get("quiz_id") or not think(args.think_quiz):
+            continue
+        questions = (result.get("quiz") or {}).get("quiz") or []
+        recorder.call(
+            session,
+            "quiz_mark",
+            "POST",
+            f"{base_url}/quiz/mark",
+            json={
+                "quiz_id": result["quiz_id"],
+                "answers": {str(i): rng.choice(QUIZ_OPTIONS) for i in range(len(questions))},
+            },
+        )
+
+
+def _values(families, name, **labels):
+    return [
+        value
+        for sample_labels, value in families.get(name, [])
+        if all(sample_labels.get(key) == wanted for key, wanted in labels.items())
+    ]
+
+
+def _total(families, name, **labels):
+    return sum(_values(families, name, **labels))
+
+
+class Sampler:
+    """Samples /metrics (and Postgres, if DB_URL is set) in a background thread."""
+
+    def __init__(self, base_url, interval, started):
+        self.base_url = base_url
+        self.interval = interval
+        self.started = started
+        self.samples = []
+        self.first = None
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._session = requests.Session()
+        self._db = None
+
+    def scrape(self):
+        text = self._session.get(f"{self.base_url}/metrics", timeout=30).text
+        families = defaultdict(list)
+        for family in text_string_to_metric_families(text):
+            for sample in family.samples:
+                families[sample.name].append((sample.labels, sample.value))
+        return families
+
+    def _postgres(self):
+        if not os.getenv("DB_URL"):
+            return None
+        try:
+            if self._db is None:
+                import psycopg2
+
+                self._db = psycopg2.connect(os.getenv("DB_URL"))
+                self._db.autocommit = True
+            with self._db.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT count(*), count(*) FILTER (WHERE state = 'active')
+                    FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    """
+                )
+                connections, active = cur.fetchone()
+            return {"connections": connections, "active": active}
+        except Exception as e:
+            print("Could not sample Postgres:", e, file=sys.stderr)
+            self._db = None
+            return None
+
+    def sample(self):
+        families = self.scrape()
+        if self.first is None:
+            self.first = families
+        self.last = families
+        voices = {labels["voice"] for labels, _ in families.get("speech_synthesizers_created", [])}
+        point = {
+            "t": round(time.monotonic() - self.started, 1),
+            "in_flight": _total(families, "http_requests_in_flight"),
+            "db_pool_in_use": _total(families, "db_pool_in_use"),
+            "db_pool_max_size": _total(families, "db_pool_max_size"),
+            "db_pool_waits": _total(families, "db_pool_waits"),
+            "db_pool_timeouts": _total(families, "db_pool_timeouts"),
+            "judge_queue": _total(families, "executor_queue_depth", pool="judge"),
+            "submissions_queue": _total(families, "executor_queue_depth", pool="submissions"),
+            "synthesizers_in_use": {
+                voice: _total(families, "speech_synthesizers_created", voice=voice)
+                - _total(families, "speech_synthesizers_idle", voice=voice)
+                for voice in voices
+            },
+            "postgres": self._postgres(),
+        }
+        self.samples.append(point)
+        return point
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                point = self.sample()
+            except Exception as e:
+                print("Could not sample /metrics:", e, file=sys.stderr)
+                continue
+            postgres = point["postgres"] or {}
+            print(
+                f"t={point['t']:>6}s in_flight={point['in_flight']:.0f} "
+                f"db_pool={point['db_pool_in_use']:.0f}/{point['db_pool_max_size']:.0f} "
+                f"pg={postgres.get('connections', '-')} "
+                f"judge_q={point['judge_queue']:.0f} "
+                f"tts_busy={sum(point['synthesizers_in_use'].values()):.0f}",
+                file=sys.stderr,
+                flush=True,
+            )
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.sample()
+        except Exception:
+            pass
+        self._session.close()
+        if self._db is not None:
+            self._db.close()
+
+
+def dependency_latency(first, last):
+    """Calls and mean latency of each dependency between two scrapes."""
+    result = {}
+    for name, histogram in DEPENDENCIES.items():
+        count = _total(last, f"{histogram}_count") - _total(first, f"{histogram}_count")
+        total = _total(last, f"{histogram}_sum") - _total(first, f"{histogram}_sum")
+        result[name] = {"calls": count, "mean": total / count if count else None}
+    return result
+
+
+def saturation(samples, capacity):
+    """Peaks of the sampled gauges, and which of them hit their limit."""
+    if not samples:
+        return {}, []
+
+    def peak(key):
+        return max(sample[key] for sample in samples)
+
+    voices = {voice for sample in samples for voice in sample["synthesizers_in_use"]}
+    postgres = [sample["postgres"] for sample in samples if sample["postgres"]]
+    peaks = {
+        "in_flight": peak("in_flight"),
+        "db_pool_in_use": peak("db_pool_in_use"),
+        "db_pool_max_size": peak("db_pool_max_size"),
+        "db_pool_waits": samples[-1]["db_pool_waits"] - samples[0]["db_pool_waits"],
+        "db_pool_timeouts": samples[-1]["db_pool_timeouts"] - samples[0]["db_pool_timeouts"],
+        "judge_queue": peak("judge_queue"),
+        "submissions_queue": peak("submissions_queue"),
+        "synthesizers_in_use": {
+            voice: max(sample["synthesizers_in_use"].get(voice, 0) for sample in samples)
+            for voice in voices
+        },
+        "postgres_connections": max((p["connections"] for p in postgres), default=None),
+        "postgres_active": max((p["active"] for p in postgres), default=None),
+    }
+
+    saturated = []
+    if capacity and peaks["in_flight"] >= capacity:
+        saturated.append(f"web threads: {peaks['in_flight']:.0f} requests in flight, capacity {capacity}")
+    if peaks["db_pool_max_size"] and peaks["db_pool_in_use"] >= peaks["db_pool_max_size"]:
+        saturated.append(f"database pool: all {peaks['db_pool_max_size']:.0f} connections in use")
+    if peaks["db_pool_waits"] > 0:
+        saturated.append(
+            f"database pool: {peaks['db_pool_waits']:.0f} waits for a connection, "
+            f"{peaks['db_pool_timeouts']:.0f} timeouts"
+        )
+    if peaks["judge_queue"] > 0:
+        saturated.append(f"judge workers: up to {peaks['judge_queue']:.0f} test runs queued")
+    if peaks["submissions_queue"] > 0:
+        saturated.append(f"submission workers: up to {peaks['submissions_queue']:.0f} jobs queued")
+    pool_size = int(os.getenv("SPEECH_POOL_SIZE", "2"))
+    for voice, busy in peaks["synthesizers_in_use"].items():
+        if busy >= pool_size:
+            saturated.append(f"speech synthesizers: all {busy:.0f} for {voice} in use")
+    return peaks, saturated
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+
+def print_report(report):
+    print(f"{'action':<18} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7} {'errors':>6}")
+    for action, stats in report["actions"].items():
+        print(
+            f"{action:<18} {stats['requests']:>8} {_ms(stats['p50'])} {_ms(stats['p95'])} "
+            f"{_ms(stats['p99'])} {stats['rps']:7.2f} {stats['errors']:>6}"
+        )
+        if stats["first_error"]:
+            print(f"    first error: {stats['first_error']}")
+
+    print("\nDependency calls during the session:")
+    for name, stats in report["dependencies"].items():
+        print(f"  {name:<8} {stats['calls']:>8.0f} calls, mean {_ms(stats['mean']).strip()} ms")
+
+    peaks = report["peaks"]
+    if peaks:
+        print("\nPeaks:")
+        print(f"  requests in flight       {peaks['in_flight']:.0f}")
+        print(
+            f"  database pool in use     {peaks['db_pool_in_use']:.0f} of "
+            f"{peaks['db_pool_max_size']:.0f} (scraped worker)"
+        )
+        if peaks["postgres_connections"] is not None:
+            print(
+                f"  postgres connections     {peaks['postgres_connections']}, "
+                f"{peaks['postgres_active']} active"
+            )
+        print(f"  judge queue depth        {peaks['judge_queue']:.0f}")
+        print(f"  submissions queue depth  {peaks['submissions_queue']:.0f}")
+        for voice, busy in sorted(peaks["synthesizers_in_use"].items()):
+            print(f"  synthesizers in use      {busy:.0f} ({voice})")
+
+    print("\nSaturated:" if report["saturated"] else "\nNothing saturated.")
+    for line in report["saturated"]:
+        print(f"  {line}")
+
+
+def spawn_server(args):
+    """Starts bench/fakes.py --app on the port of --url and waits for it."""
+    port = urlparse(args.url).port or 80
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port))
+    if not args.caches:
+        # Every student submits different code in a real session
+        env.update(LLM_CACHE_ENABLED="false", JUDGE_CACHE_ENABLED="false")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SERVER_DIR, "bench", "fakes.py"),
+            "--app",
+            "--openai-port",
+            "0",
+            "--judge-port",
+            "0",
+            "--llm-latency",
+            str(args.llm_latency),
+            "--judge-latency",
+            str(args.judge_latency),
+            "--tts-latency",
+            str(args.tts_latency),
+            "--stt-latency",
+            str(args.stt_latency),
+        ],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("The server exited on startup")
+        try:
+            if requests.get(f"{args.url}/health/db", timeout=2).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise SystemExit("The server did not start within 60 seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5051")
+    parser.add_argument("--spawn", action="store_true", help="serve the app against the fakes")
+    parser.add_argument("--students", type=int, default=60)
+    parser.add_argument("--programs", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=300, help="seconds of session")
+    parser.add_argument("--ramp", type=float, default=60, help="seconds over which students arrive")
+    parser.add_argument("--think-code", type=float, default=90, help="mean seconds between submissions")
+    parser.add_argument("--think-chat", type=float, default=20, help="mean seconds between questions")
+    parser.add_argument("--think-quiz", type=float, default=45, help="mean seconds to answer a quiz")
+    parser.add_argument("--chats", type=int, default=2, help="mean questions per submission")
+    parser.add_argument("--speed", type=float, default=1.0, help="runs the session this many times faster")
+    parser.add_argument("--capacity", type=int, help="web workers * threads of the server")
+    parser.add_argument("--sample-interval", type=float, default=2.0)
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--judge-latency", type=float, default=0.5)
+    parser.add_argument("--tts-latency", type=float, default=0.5)
+    parser.add_argument("--stt-latency", type=float, default=0.5)
+    parser.add_argument(
+        "--caches", action="store_true", help="keep the LLM and Judge0 caches on with --spawn"
+    )
+    parser.add_argument("--output", help="also write the report as JSON here")
+    parser.add_argument("--keep", action="store_true", help="keep the classroom's rows")
+    parser.add_argument("--verbose", action="store_true", help="show the spawned server's output")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    server = spawn_server(args) if args.spawn else None
+    tag = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    registered = []
+    classroom = None
+    try:
+        print(f"Setting up classroom {tag}...", file=sys.stderr, flush=True)
+        classroom = setup_classroom(args.url, recorder, args.programs, tag)
+        started = time.monotonic()
+        deadline = started + args.duration / args.speed
+        sampler = Sampler(args.url, args.sample_interval, started).start()
+        threads = [
+            threading.Thread(
+                target=student,
+                args=(i, args, args.url, classroom, recorder, deadline, registered, tag),
+                daemon=True,
+            )
+            for i in range(args.students)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.monotonic() - started
+        sampler.stop()
+
+        peaks, saturated = saturation(sampler.samples, args.capacity)
+        report = {
+            "settings": {key: value for key, value in vars(args).items() if key != "output"},
+            "wall": wall,
+            "actions": recorder.summary(wall),
+            "dependencies": dependency_latency(sampler.first, sampler.last),
+            "peaks": peaks,
+            "saturated": saturated,
+            "timeline": sampler.samples,
+        }
+    finally:
+        recorder.close()
+        if classroom and not args.keep and os.getenv("DB_URL"):
+            cleanup(
+                {
+                    "class_id": classroom["class_id"],
+                    "students": registered + [classroom["professor"]],
+                    "programs": classroom["programs"],
+                }
+            )
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved to {args.output}")
+    return 1 if any(stats["errors"] for stats in report["actions"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""
+Endpoint latency and throughput benchmark.
+
+Serves the app in this process against the local stand-ins in bench/fakes.py
+instead of OpenAI, Azure Speech and Judge0, and the Postgres in DB_URL. The
+endpoints are run one after the other. Each gets --requests requests from
+--concurrency clients at once, and the script reports p50/p95/p99 latency
+and requests per second for each.
+
+A classroom with one student and one program per client is created for the
+run and deleted afterwards. The LLM and Judge0 caches are turned off, so
+every request pays for the (fake) external calls, unless --caches is given.
+Audio goes to a temporary folder. The migrations must already be applied.
+
+Results are saved to bench/results/<commit>.json. Pass --compare with a
+commit or a results file to print the change against an earlier run.
+
+Usage, from the server folder:
+
+    python bench/endpoints.py [--requests 40] [--concurrency 4]
+        [--endpoints submit_code,chat_message] [--llm-latency 0.2]
+        [--compare HEAD~1]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SERVER_DIR, "bench", "results")
+
+sys.path.insert(0, SERVER_DIR)
+
+from fakes import FakeJudge0, FakeOpenAI, install_fake_speech  # noqa: E402
+
+PROGRAM_CODE = """#include <stdio.h>
+
+int main() {
+    int a, b;
+    scanf("%d %d", &a, &b);
+    printf("%d\\n", a + b);
+    return 0;
+}
+"""
+
+
+def _submit_code(ctx, worker, n):
+    return "POST", "/submissions", {
+        "user_id": ctx["students"][worker],
+        "program_id": ctx["programs"][worker],
+        "code": PROGRAM_CODE,
+        "language_id": 50,
+        "quiz_language": "en",
+    }
+
+
+def _chat_message(ctx, worker, n):
+    return "POST", "/chat/message", {
+        "user_id": ctx["students"][worker],
+        "program_id": ctx["programs"][worker],
+        "text": f"Why does my loop stop early? ({n})",
+        "language": "en",
+    }
+
+
+def _chat_message_stream(ctx, worker, n):
+    method, _, body = _chat_message(ctx, worker, n)
+    return method, "/chat/message/stream", body
+
+
+def _regenerate_summaries(ctx, worker, n):
+    # One program per client, since regenerating the same program twice at
+    # once makes one of them fail on the summaries unique index
+    return "POST", f"/programs/{ctx['programs'][worker]}/regenerate_summaries?refresh=true", None
+
+
+def _program_detail(ctx, worker, n):
+    return "GET", f"/programs/{ctx['programs'][worker]}", None
+
+
+# Name -> function(context, client index, request number) returning
+# (method, path, JSON body)
+ENDPOINTS = {
+    "program_detail": _program_detail,
+    "submit_code": _submit_code,
+    "chat_message": _chat_message,
+    "chat_message_stream": _chat_message_stream,
+    "generate_and_save_summaries": _regenerate_summaries,
+}
+
+
+def seed(clients):
+    """Creates a classroom with one student and one program per client."""
+    from src.db import transaction
+
+    tag = uuid.uuid4().hex[:8]
+    with transaction() as tx:
+        class_id = tx.query(
+            "INSERT INTO classrooms (name) VALUES (%s) RETURNING id",
+            (f"Benchmark {tag}",),
+            one=True,
+        )["id"]
+        students = [
+            row["id"]
+            for row in tx.bulk_insert(
+                "users",
+                ["username", "password", "role", "class_id"],
+                [(f"bench_{tag}_{i}", "-", "student", class_id) for i in range(clients)],
+                returning=["id"],
+            )
+        ]
+        programs = [
+            row["id"]
+            for row in tx.bulk_insert(
+                "programs",
+                ["title", "description", "code", "class_id"],
+                [
+                    (f"Benchmark {tag} {i}", "Adds two numbers", PROGRAM_CODE, class_id)
+                    for i in range(clients)
+                ],
+                returning=["id"],
+            )
+        ]
+    return {"class_id": class_id, "students": students, "programs": programs}
+
+
+def cleanup(ctx):
+    from src.db import transaction
+
+    with transaction() as tx:
+        # Classrooms and their professor refer to each other
+        tx.query("UPDATE classrooms SET professor_id = NULL WHERE id = %s", (ctx["class_id"],))
+        for table in ("messages", "submissions", "quizzes", "submission_jobs", "summaries"):
+            tx.query(f"DELETE FROM {table} WHERE program_id = ANY(%s)", (ctx["programs"],))
+        tx.query("DELETE FROM programs WHERE id = ANY(%s)", (ctx["programs"],))
+        tx.query("DELETE FROM users WHERE id = ANY(%s)", (ctx["students"],))
+        tx.query("DELETE FROM classrooms WHERE id = %s", (ctx["class_id"],))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_endpoint(base_url, ctx, build, requests_count, concurrency):
+    """
+    Sends requests_count requests built by build() from concurrency clients.
+    Returns the summary statistics; failed requests are counted as errors
+    and left out of the latencies.
+    """
+    sessions = [requests.Session() for _ in range(concurrency)]
+    counter = iter(range(requests_count))
+    counter_lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def client(worker):
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            method, path, body = build(ctx, worker, n)
+            start = time.perf_counter()
+            try:
+                response = sessions[worker].request(method, base_url + path, json=body)
+                # Streamed replies report failures as an error event
+                ok = response.status_code < 400 and b"event: error" not in response.content
+                detail = response.text[:200]
+            except requests.RequestException as e:
+                ok, detail = False, str(e)
+            elapsed = time.perf_counter() - start
+            with counter_lock:
+                (latencies if ok else errors).append(elapsed if ok else detail)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    wall = time.perf_counter() - start
+    for session in sessions:
+        session.close()
+
+    latencies.sort()
+    return {
+        "requests": requests_count,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "rps": len(latencies) / wall if wall else None,
+    }
+
+
+def git_commit():
+    """Returns (short commit hash, whether the tree has local changes)."""
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=SERVER_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short=12", "HEAD") or "unknown"
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return commit, dirty
+
+
+def results_path(commit, dirty):
+    return os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+
+
+def load_baseline(ref):
+    """Loads a results file, given its path or the commit it was run on."""
+    if os.path.isfile(ref):
+        path = ref
+    else:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short=12", ref],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        path = results_path(commit or ref, False)
+        if not os.path.isfile(path):
+            path = results_path(commit or ref, True)
+    if not os.path.isfile(path):
+        raise SystemExit(f"No saved results for {ref}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+
+def _change(new, old):
+    if new is None or not old:
+        return "      -"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'errors':>6}")
+    for name, stats in results["endpoints"].items():
+        rps = f"{stats['rps']:8.2f}" if stats["rps"] is not None else "       -"
+        print(
+            f"{name:<28} {_ms(stats['p50'])} {_ms(stats['p95'])} {_ms(stats['p99'])} "
+            f"{rps} {stats['errors']:>6}"
+        )
+        if stats["first_error"]:
+            print(f"    first error: {stats['first_error']}")
+        old = (baseline or {}).get("endpoints", {}).get(name)
+        if old:
+            print(
+                f"{'  vs ' + baseline['commit']:<28} {_change(stats['p50'], old['p50']):>8} "
+                f"{_change(stats['p95'], old['p95']):>8} {_change(stats['p99'], old['p99']):>8} "
+                f"{_change(stats['rps'], old['rps']):>8}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=40, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests per endpoint")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--judge-latency", type=float, default=0.05)
+    parser.add_argument("--tts-latency", type=float, default=0.1)
+    parser.add_argument("--stt-latency", type=float, default=0.1)
+    parser.add_argument("--caches", action="store_true", help="keep the LLM and Judge0 caches on")
+    parser.add_argument("--compare", metavar="REF", help="commit or results file to compare with")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}")
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    openai_server = FakeOpenAI(args.llm_latency).start()
+    judge_server = FakeJudge0(args.judge_latency).start()
+    # Read when the app modules are imported, so set before importing them
+    os.environ["OPENAI_BASE_URL"] = openai_server.base_url
+    os.environ["CHATGPT_API_KEY"] = "bench"
+    os.environ["JUDGE_URL"] = judge_server.url
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    if not args.caches:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["JUDGE_CACHE_ENABLED"] = "false"
+
+    from werkzeug.serving import make_server
+    from src.server import app
+
+    install_fake_speech(args.tts_latency, args.stt_latency)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    httpd = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_port}"
+
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    ctx = seed(args.concurrency)
+    endpoints = {}
+    try:
+        # The app prints prompts and replies; progress goes to stderr
+        with redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            for name in names:
+                build = ENDPOINTS[name]
+                if args.warmup:
+                    run_endpoint(base_url, ctx, build, args.warmup, 1)
+                print(f"Running {name}...", file=sys.stderr, flush=True)
+                endpoints[name] = run_endpoint(
+                    base_url, ctx, build, args.requests, args.concurrency
+                )
+    finally:
+        cleanup(ctx)
+        httpd.shutdown()
+        openai_server.stop()
+        judge_server.stop()
+        os.chdir(SERVER_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {
+            key: getattr(args, key)
+            for key in (
+                "requests",
+                "concurrency",
+                "llm_latency",
+                "judge_latency",
+                "tts_latency",
+                "stt_latency",
+                "caches",
+            )
+        },
+        "endpoints": endpoints,
+    }
+    print_results(results, baseline)
+    if baseline and baseline.get("settings") != results["settings"]:
+        print(f"Note: {baseline['commit']} was run with other settings: {baseline['settings']}")
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = results_path(commit, dirty)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved to {os.path.relpath(path, SERVER_DIR)}")
+    return 1 if any(stats["errors"] for stats in endpoints.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""
+Local stand-ins for the services the app pays for, used by the benchmarks.
+
+- FakeOpenAI serves /v1/chat/completions like the OpenAI API, streaming
+  included. It answers generate_quiz and summarize_code prompts with canned
+  JSON of the right shape and anything else (the chat tutor) with a short
+  hint. The openai SDK is pointed at it through OPENAI_BASE_URL.
+- FakeJudge0 serves /submissions and /submissions/batch like Judge0. A run
+  stays "Processing" for the configured latency and then echoes its stdin.
+  The app is pointed at it through JUDGE_URL.
+- install_fake_speech() replaces the Azure synthesizers and speech recognition
+  in the current process, since the Azure SDK talks to its own endpoints.
+
+Every reply carries a counter, so summaries and chat replies differ from one
+request to the next and the TTS cache does not hide the synthesis latency.
+
+Run on its own to start the fake servers for a manually started app, or with
+--app to also serve the app as `python main.py` does (gunicorn, settings from
+gunicorn.conf.py) with all three fakes installed, e.g. for bench/classroom.py:
+
+    python bench/fakes.py [--app] [--llm-latency 0.2] [--judge-latency 0.05]
+        [--tts-latency 0.1] [--stt-latency 0.1]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUIZ_QUESTIONS = 10
+
+
+def quiz_reply(n):
+    """A generate_quiz reply: a correct submission with a 10 question quiz."""
+    return json.dumps(
+        {
+            "code_errors": [],
+            "code_correct": True,
+            "quiz": [
+                {
+                    "question": f"Benchmark question {i} ({n})?",
+                    "options": ["A) one", "B) two", "C) three", "D) four"],
+                }
+                for i in range(QUIZ_QUESTIONS)
+            ],
+            "answer_key": {str(i): "ABCD"[i % 4] for i in range(QUIZ_QUESTIONS)},
+            "test_inputs": ["1 2\n", "3 4\n", "5 6\n"],
+        }
+    )
+
+
+def summary_reply(n):
+    """A summarize_code reply."""
+    return json.dumps(
+        {
+            "explanation": f"The program reads two numbers and prints their sum ({n}).",
+            "translation": f"This program adds two numbers and prints the answer ({n}).",
+            "algorithm": "1. Read a and b\\n2. Add them\\n3. Print the sum",
+        }
+    )
+
+
+def hint_reply(n):
+    """A chat tutor reply."""
+    return f"Check the condition of your loop, it stops one step too early ({n})."
+
+
+class _Server:
+    """A threaded HTTP server run in a daemon thread, see start() and stop()."""
+
+    def __init__(self, handler, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json({"error": {"message": "Not found"}}, status=404)
+            return
+        body = self.read_json()
+        content = self.fake.reply(body.get("messages", []))
+        if body.get("stream"):
+            self.stream(body.get("model", ""), content)
+        else:
+            time.sleep(self.fake.latency)
+            self.send_json(
+                {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", ""),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+            )
+
+    def stream(self, model, content):
+        """Sends content word by word as chunks, spread over the latency."""
+        words = re.findall(r"\S+\s*", content) or [content]
+        delay = self.fake.latency / len(words)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+
+        for index, word in enumerate(words + [None]):
+            time.sleep(delay if word is not None else 0)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word} if word is not None else {},
+                        "finish_reason": None if word is not None else "stop",
+                    }
+                ],
+            }
+            send(json.dumps(chunk))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOpenAI(_Server):
+    def __init__(self, latency=0.2, **kwargs):
+        super().__init__(_OpenAIHandler, **kwargs)
+        self.latency = latency
+        self._counter = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def reply(self, messages):
+        n = next(self._counter)
+        prompt = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") != "system")
+        if "<START OF ACTUAL CODE>" in prompt:
+            return quiz_reply(n)
+        if '"explanation"' in prompt:
+            return summary_reply(n)
+        return hint_reply(n)
+
+
+def _encode(text):
+    return base64.b64encode((text or "").encode()).decode()
+
+
+class _Judge0Handler(_Handler):
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self.read_json()
+        if path == "/submissions":
+            self.send_json({"token": self.fake.submit(body)}, status=201)
+        elif path == "/submissions/batch":
+            self.send_json(
+                [{"token": self.fake.submit(entry)} for entry in body.get("submissions", [])],
+                status=201,
+            )
+        else:
+            self.send_json({"error": "Not found"}, status=404)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        path = path.rstrip("/")
+        if path == "/submissions/batch":
+            match = re.search(r"(?:^|&)tokens=([^&]*)", query)
+            tokens = match.group(1).split(",") if match else []
+            self.send_json({"submissions": [self.fake.status(token) for token in tokens]})
+        elif path.startswith("/submissions/"):
+            result = self.fake.status(path.rsplit("/", 1)[1])
+            if result.get("status") is None:
+                self.send_json({"error": "Not found"}, status=404)
+            else:
+                self.send_json(result)
+        else:
+            self.send_json({"error": "Not found"}, status=404)
+
+
+class FakeJudge0(_Server):
+    def __init__(self, latency=0.05, **kwargs):
+        super().__init__(_Judge0Handler, **kwargs)
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._runs = {}
+
+    def submit(self, submission):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._runs[token] = (time.monotonic() + self.latency, submission.get("stdin"))
+        return token
+
+    def status(self, token):
+        with self._lock:
+            run = self._runs.get(token)
+        if run is None:
+            return {"token": token, "status": None}
+        done_at, stdin = run
+        if time.monotonic() < done_at:
+            return {"token": token, "status": {"id": 2, "description": "Processing"}}
+        return {
+            "token": token,
+            "stdout": _encode(stdin),
+            "stderr": None,
+            "compile_output": None,
+            "status": {"id": 3, "description": "Accepted"},
+            "time": "0.001",
+            "memory": 1024,
+        }
+
+
+class _FakeSynthesis:
+    def __init__(self, latency, audio):
+        self.latency = latency
+        self.audio = audio
+
+    def get(self):
+        from src.clients import speechsdk
+
+        time.sleep(self.latency)
+        return SimpleNamespace(
+            reason=speechsdk().ResultReason.SynthesizingAudioCompleted,
+            audio_data=self.audio,
+        )
+
+
+class _FakeSynthesizer:
+    def __init__(self, latency, audio):
+        self.latency = latency
+        self.audio = audio
+
+    def speak_text_async(self, text):
+        return _FakeSynthesis(self.latency, self.audio)
+
+
+def install_fake_speech(tts_latency=0.1, stt_latency=0.1, audio_bytes=16 * 1024):
+    """
+    Replaces Azure text-to-speech and speech-to-text in this process.
+    Synthesizers still come from the app's pool, so its limits and waits
+    apply, but return audio_bytes of silence after tts_latency. Recognition
+    returns a fixed transcript after stt_latency and is recorded in the
+    metrics like the real call.
+    """
+    from src import metrics, speech
+
+    audio = b"\xff\xfb" + bytes(audio_bytes - 2)
+    speech.synthesizers._new_synthesizer = lambda voice: _FakeSynthesizer(tts_latency, audio)
+
+    def recognize(audio_config, language="en"):
+        start = time.monotonic()
+        time.sleep(stt_latency)
+        metrics.observe(
+            metrics.SPEECH_LATENCY,
+            time.monotonic() - start,
+            operation="stt",
+            voice=speech.RECOGNITION_LANGUAGES.get(language, language),
+            outcome="ok",
+        )
+        return "How do I fix my loop?", None
+
+    speech.recognize = recognize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=5061)
+    parser.add_argument("--judge-port", type=int, default=5062)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--judge-latency", type=float, default=0.05)
+    parser.add_argument("--tts-latency", type=float, default=0.1)
+    parser.add_argument("--stt-latency", type=float, default=0.1)
+    parser.add_argument("--app", action="store_true", help="also serve the app")
+    args = parser.parse_args()
+
+    openai_server = FakeOpenAI(args.llm_latency, host=args.host, port=args.openai_port).start()
+    judge_server = FakeJudge0(args.judge_latency, host=args.host, port=args.judge_port).start()
+    print(f"OPENAI_BASE_URL={openai_server.base_url}")
+    print(f"JUDGE_URL={judge_server.url}", flush=True)
+
+    if args.app:
+        # Read when the app modules are imported. The fake servers keep
+        # running in the gunicorn master, and the workers inherit the
+        # speech fake installed before they are forked
+        os.environ["OPENAI_BASE_URL"] = openai_server.base_url
+        os.environ["CHATGPT_API_KEY"] = "bench"
+        os.environ["JUDGE_URL"] = judge_server.url
+        os.environ["WARM_SPEECH_VOICES"] = ""
+        sys.path.insert(0, SERVER_DIR)
+        from src.cli import run_production
+
+        # Keeps the fake audio out of the server's media folder
+        workdir = tempfile.mkdtemp(prefix="bench-app-")
+        os.chdir(workdir)
+        master = os.getpid()
+        try:
+            run_production(
+                on_load=lambda: install_fake_speech(args.tts_latency, args.stt_latency)
+            )
+        finally:
+            # Workers exit through here as well
+            if os.getpid() == master:
+                os.chdir(SERVER_DIR)
+                shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        print("Azure speech is only faked with --app. Ctrl-C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    openai_server.stop()
+    judge_server.stop()
+
+
+if __name__ == "__main__":
+    main()
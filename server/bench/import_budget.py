@@ -0,0 +1,85 @@
+"""
+Import time budget check.
+
+Imports the app in fresh interpreters under `python -X importtime` and fails
+if the best of several runs takes longer than the budget, or if any of the
+heavy SDKs that are meant to load on first use (see src/clients.py) were
+imported.
+
+Usage, from the server folder:
+
+    python bench/import_budget.py [--budget-ms 1000] [--runs 3] [--top 10]
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULE = "src.server"
+# About 2.5 times the import time measured on a laptop, leaving room for
+# slower machines while still catching an eager SDK import (openai alone
+# takes about a second)
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1000"))
+LAZY_MODULES = ["openai", "azure.cognitiveservices.speech"]
+
+LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| *(\S+)$")
+
+
+def measure():
+    """
+    Returns the cumulative import time in microseconds of every module loaded
+    by one import of the app in a fresh interpreter.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {APP_MODULE}"],
+        cwd=SERVER_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Importing {APP_MODULE} failed")
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules[match.group(2)] = int(match.group(1))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(args.runs, 1))]
+    best = min(runs, key=lambda modules: modules[APP_MODULE])
+    total_ms = best[APP_MODULE] / 1000
+
+    print(f"{APP_MODULE} imports in {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    slowest = sorted(
+        (item for item in best.items() if item[0] != APP_MODULE),
+        key=lambda item: -item[1],
+    )[: args.top]
+    for name, micros in slowest:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in best]
+    if eager:
+        failed = True
+        print(f"Imported at startup, should load lazily: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failed = True
+        print(f"Over budget by {total_ms - args.budget_ms:.0f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,661 @@
+"""
+Query plan regression check.
+
+Seeds the database in DB_URL with a realistic classroom-sized data set, runs
+every query the blueprints issue under EXPLAIN ANALYZE and fails if any of
+them reads a table with a Seq Scan. Listings that return a whole table on
+purpose (e.g. GET /programs) are allowed to scan it, and so are tables of
+only a few pages (e.g. classrooms), which Postgres rightly reads whole.
+It also fails if a listed statement no longer appears in src/, since the
+queries are copied here by hand.
+
+Everything happens in one transaction that is rolled back at the end, so the
+database is left as it was. The migrations must already be applied.
+
+Usage, from the server folder:
+
+    python bench/query_plans.py [--scale 1.0] [--verbose]
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+import psycopg2
+import psycopg2.extras
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from src.pagination import page_query  # noqa: E402
+
+load_dotenv()
+
+# Seeded rows get ids from here on so they never collide with real data
+BASE = 1_000_000
+
+# Rows per table at --scale 1
+VOLUMES = {
+    "classrooms": 40,
+    "students_per_class": 60,
+    "programs_per_class": 25,
+    "messages": 200_000,
+    "submissions": 40_000,
+    "quizzes": 40_000,
+    "submission_jobs": 10_000,
+    "llm_cache": 4_000,
+    "judge_cache": 20_000,
+}
+
+LANGUAGES = ["en", "ka", "fr", "de"]
+
+# Tables up to this many pages may be scanned by any query
+SMALL_TABLE_PAGES = 8
+
+
+def volumes(scale):
+    return {name: max(int(count * scale), 1) for name, count in VOLUMES.items()}
+
+
+def seed(cur, v):
+    """
+    Seeds v["classrooms"] classrooms with one professor, their students and
+    programs each. Student s and program p belong to classroom
+    1 + (s - 1) % classrooms, and each student chats about, submits and takes
+    quizzes on programs of their own classroom.
+    """
+    n = v["classrooms"]
+    students = n * v["students_per_class"]
+    programs = n * v["programs_per_class"]
+    params = {
+        "base": BASE,
+        "n": n,
+        "students": students,
+        "programs": programs,
+        "ppc": v["programs_per_class"],
+    }
+
+    def run(query, **extra):
+        cur.execute(query, dict(params, **extra))
+
+    run(
+        """
+        INSERT INTO classrooms (id, name)
+        SELECT %(base)s + c, 'Bench class ' || c FROM generate_series(1, %(n)s + 1) c
+        """
+    )
+    # Professors take ids base + 1..n, students the ids after them
+    run(
+        """
+        INSERT INTO users (id, username, password, role, class_id)
+        SELECT %(base)s + c, 'bench_prof_' || c, repeat('h', 100), 'professor', %(base)s + c
+        FROM generate_series(1, %(n)s) c
+        """
+    )
+    run(
+        """
+        INSERT INTO users (id, username, password, role, class_id)
+        SELECT %(base)s + %(n)s + s, 'bench_student_' || s, repeat('h', 100),
+            'student', %(base)s + 1 + (s - 1) %% %(n)s
+        FROM generate_series(1, %(students)s + 1) s
+        """
+    )
+    run(
+        """
+        UPDATE classrooms SET professor_id = id
+        WHERE id BETWEEN %(base)s + 1 AND %(base)s + %(n)s
+        """
+    )
+    run(
+        """
+        INSERT INTO programs (id, title, description, code, class_id, created_by)
+        SELECT %(base)s + p, 'Bench program ' || p, repeat('d', 200), repeat('c', 2000),
+            %(base)s + 1 + (p - 1) %% %(n)s, %(base)s + 1 + (p - 1) %% %(n)s
+        FROM generate_series(1, %(programs)s + 1) p
+        """
+    )
+    run(
+        """
+        INSERT INTO summaries (program_id, language, summary, audio_link, algorithm)
+        SELECT %(base)s + p, l, repeat('s', 2000),
+            'media/bench-' || p || '-' || l || '.mp3', repeat('a', 500)
+        FROM generate_series(1, %(programs)s) p, unnest(%(languages)s) l
+        """,
+        languages=LANGUAGES,
+    )
+
+    # Row g belongs to student s = 1 + g % students; the student works through
+    # the programs of their classroom in blocks of rows
+    student = "(1 + g %% %(students)s)"
+    program = (
+        f"(1 + ({student} - 1) %% %(n)s + %(n)s * ((g / %(students)s / %(block)s) %% %(ppc)s))"
+    )
+    run(
+        f"""
+        INSERT INTO messages (program_id, user_id, content, "from", audio_link, sent_at)
+        SELECT %(base)s + {program}, %(base)s + %(n)s + {student}, repeat('m', 200),
+            CASE WHEN g %% 2 = 0 THEN 'student' ELSE 'bot' END,
+            CASE WHEN g %% 2 = 1 THEN 'media/bench-msg-' || g || '.mp3' END,
+            CURRENT_TIMESTAMP - make_interval(secs => %(count)s - g)
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["messages"],
+        block=20,
+    )
+    run(
+        f"""
+        INSERT INTO submissions (program_id, student_id, code, has_error, feedback)
+        SELECT %(base)s + {program}, %(base)s + %(n)s + {student}, repeat('c', 2000),
+            g %% 5 = 0, repeat('f', 300)
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["submissions"],
+        block=1,
+    )
+    run(
+        f"""
+        INSERT INTO quizzes (id, program_id, student_id, class_id, questions, answers, marks)
+        SELECT %(base)s + g, %(base)s + {program}, %(base)s + %(n)s + {student},
+            %(base)s + 1 + ({student} - 1) %% %(n)s,
+            '[{{"question": "q", "options": ["A) a", "B) b"]}}]'::jsonb, '{{"0": "A"}}',
+            CASE WHEN g %% 3 = 0 THEN NULL ELSE g %% 6 END
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["quizzes"],
+        block=1,
+    )
+    run(
+        f"""
+        INSERT INTO submission_jobs (id, student_id, program_id, payload, status)
+        SELECT 'bench-job-' || g, %(base)s + %(n)s + {student}, %(base)s + {program},
+            '{{}}'::jsonb, 'done'
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["submission_jobs"],
+        block=1,
+    )
+    run(
+        """
+        INSERT INTO llm_cache (cache_key, model, template_version, language, code_hash, response, expires_at)
+        SELECT 'bench-llm-' || g, 'gpt-3.5-turbo', '1', 'en', md5(g::text),
+            repeat('r', 2000), CURRENT_TIMESTAMP + interval '1 day'
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["llm_cache"],
+    )
+    run(
+        """
+        INSERT INTO judge_cache (cache_key, code_hash, language_id, result)
+        SELECT 'bench-judge-' || g, md5(g::text), 50, '{"stdout": "1"}'::jsonb
+        FROM generate_series(1, %(count)s) g
+        """,
+        count=v["judge_cache"],
+    )
+    cur.execute("ANALYZE")
+
+
+def queries(v):
+    """
+    Returns (name, query, args, tables allowed to be scanned) for every query
+    the blueprints run. Plain INSERT ... VALUES statements are left out since
+    they never read a table.
+    """
+    n = v["classrooms"]
+    students = n * v["students_per_class"]
+    programs = n * v["programs_per_class"]
+    classroom = BASE + 1
+    student = BASE + n + 1
+    program = BASE + 1
+    # Rows with nothing referencing them, for the DELETE routes
+    spare_classroom = BASE + n + 1
+    spare_student = BASE + n + students + 1
+    spare_program = BASE + programs + 1
+    return [
+        # auth
+        ("POST /login", "SELECT * FROM users WHERE username = %s", ("bench_student_1",), ()),
+        (
+            "GET /me",
+            "SELECT id, username, role, class_id FROM users WHERE id = %s",
+            (student,),
+            (),
+        ),
+        # users
+        ("GET /users", "SELECT id, username, role FROM users", (), ("users",)),
+        (
+            "GET /users/<id>",
+            "SELECT id, username, role, class_id FROM users WHERE id = %s",
+            (student,),
+            (),
+        ),
+        ("DELETE /users/<id>", "DELETE FROM users WHERE id = %s", (spare_student,), ()),
+        # classrooms
+        (
+            "GET /classrooms",
+            "SELECT classrooms.*, u.username AS professor FROM classrooms JOIN users u ON classrooms.professor_id = u.id",
+            (),
+            ("classrooms", "users"),
+        ),
+        ("GET /classrooms/<id>", "SELECT * FROM classrooms WHERE id = %s", (classroom,), ()),
+        (
+            "GET /classrooms/<id> students",
+            "SELECT id, username FROM users WHERE class_id = %s AND role = 'student'",
+            (classroom,),
+            (),
+        ),
+        (
+            "GET /classrooms/<id> programs",
+            "SELECT id, title FROM programs WHERE class_id = %s",
+            (classroom,),
+            (),
+        ),
+        (
+            "DELETE /classrooms/<id>",
+            "DELETE FROM classrooms WHERE id = %s",
+            (spare_classroom,),
+            (),
+        ),
+        # programs
+        ("GET /programs", "SELECT * FROM programs", (), ("programs",)),
+        ("GET /programs/<id>", "SELECT * FROM programs WHERE id = %s", (program,), ()),
+        (
+            "GET /programs/<id> summaries",
+            "SELECT * FROM summaries WHERE program_id = %s",
+            (program,),
+            (),
+        ),
+        (
+            "GET /programs/class/<id>",
+            "SELECT * FROM programs WHERE class_id = %s",
+            (classroom,),
+            (),
+        ),
+        (
+            "POST /programs/<id>/regenerate_summaries",
+            "SELECT code FROM programs WHERE id = %s",
+            (program,),
+            (),
+        ),
+        (
+            "regenerate summaries replace",
+            "DELETE FROM summaries WHERE program_id = %s",
+            (program,),
+            (),
+        ),
+        (
+            "DELETE /programs/<id> summaries",
+            "DELETE FROM summaries WHERE program_id = %s",
+            (spare_program,),
+            (),
+        ),
+        (
+            "DELETE /programs/<id> quizzes",
+            "DELETE FROM quizzes WHERE program_id = %s",
+            (spare_program,),
+            (),
+        ),
+        (
+            "DELETE /programs/<id>",
+            "DELETE FROM programs WHERE id = %s",
+            (spare_program,),
+            (),
+        ),
+        # summaries
+        (
+            "GET /summaries/program/<id>",
+            "SELECT * FROM summaries WHERE program_id = %s",
+            (program,),
+            (),
+        ),
+        (
+            "GET /summaries/program/<id>/lang/<lang>",
+            "SELECT * FROM summaries WHERE program_id = %s AND language = %s",
+            (program, "en"),
+            (),
+        ),
+        # submissions
+        (
+            "GET /submissions/program/<id>/user/<id>",
+            "SELECT * FROM submissions WHERE program_id = %s AND student_id = %s",
+            (program, student),
+            (),
+        ),
+        (
+            "GET /submissions/user/<id>",
+            "SELECT * FROM submissions WHERE student_id = %s",
+            (student,),
+            (),
+        ),
+        (
+            "POST /submissions code",
+            "SELECT code FROM programs WHERE id = %s",
+            (program,),
+            (),
+        ),
+        (
+            "submission job update",
+            """
+            UPDATE submission_jobs
+            SET status = %s, stage = %s, result = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s RETURNING id
+            """,
+            ("running", "judging", "{}", None, "bench-job-1"),
+            (),
+        ),
+        (
+            "submission jobs still queued",
+            """
+            UPDATE submission_jobs SET updated_at = CURRENT_TIMESTAMP
+            WHERE id = ANY(%s) AND status = 'queued' RETURNING id
+            """,
+            (["bench-job-1", "bench-job-2"],),
+            (),
+        ),
+        (
+            "GET /submissions/jobs/<id>",
+            """
+            SELECT id, student_id, program_id, status, stage, result, error,
+                created_at, updated_at,
+                updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS stale
+            FROM submission_jobs WHERE id = %s
+            """,
+            (600, "bench-job-1"),
+            (),
+        ),
+        # quiz
+        (
+            "POST /quiz/mark",
+            "SELECT answers, questions FROM quizzes WHERE id = %s",
+            (BASE + 1,),
+            (),
+        ),
+        (
+            "POST /quiz/mark update",
+            "UPDATE quizzes SET answers = %s, marks = %s WHERE id = %s RETURNING answers",
+            ("{}", 1, BASE + 1),
+            (),
+        ),
+        (
+            "GET /quiz/class/<id>",
+            "SELECT * FROM quizzes WHERE class_id = %s",
+            (classroom,),
+            (),
+        ),
+        (
+            "GET /quiz/program/<id>",
+            """
+            SELECT quizzes.*, users.username
+            FROM quizzes
+            JOIN users ON quizzes.student_id = users.id
+            WHERE quizzes.program_id = %s
+            """,
+            (program,),
+            # With dozens of quizzes per program, hashing all users beats
+            # one index lookup per quiz
+            ("users",),
+        ),
+        (
+            "GET /quiz/program/<id>/user/<id>",
+            "SELECT * FROM quizzes WHERE program_id = %s AND student_id = %s",
+            (program, student),
+            (),
+        ),
+        (
+            "GET /quiz/user/<id>",
+            """
+            SELECT quizzes.*, programs.title AS program_name
+            FROM quizzes
+            JOIN programs ON quizzes.program_id = programs.id
+            WHERE quizzes.student_id = %s AND quizzes.marks IS NOT NULL
+            ORDER BY quizzes.marks DESC
+            """,
+            (student,),
+            (),
+        ),
+        # chat
+        (
+            "chat previous messages",
+            """
+            SELECT content, "from", sent_at FROM messages
+            WHERE program_id = %s AND user_id = %s
+            ORDER BY sent_at DESC, id DESC LIMIT %s
+            """,
+            (program, student, 10),
+            (),
+        ),
+        ("chat program", "SELECT code FROM programs WHERE id = %s", (program,), ()),
+        (
+            "GET /chat/messages",
+            "SELECT * FROM messages WHERE user_id = %s AND program_id = %s ORDER BY sent_at ASC, id ASC",
+            (student, program),
+            (),
+        ),
+        ("GET /health/media", "SELECT stats FROM media_sweep WHERE id = TRUE", (), ()),
+        # lookups made on behalf of the routes above
+        (
+            "llm cache get",
+            """
+            SELECT response FROM llm_cache
+            WHERE cache_key = %s AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+            """,
+            ("bench-llm-1",),
+            (),
+        ),
+        (
+            "judge cache get",
+            """
+            SELECT result,
+                last_used_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS touch
+            FROM judge_cache WHERE cache_key = %s
+            """,
+            (300, "bench-judge-1"),
+            (),
+        ),
+        (
+            "judge cache touch",
+            """
+            UPDATE judge_cache SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+            WHERE cache_key = %s RETURNING cache_key
+            """,
+            ("bench-judge-1",),
+            (),
+        ),
+        (
+            "tts cache referenced",
+            """
+            SELECT EXISTS (SELECT 1 FROM summaries WHERE audio_link = %s)
+                OR EXISTS (SELECT 1 FROM messages WHERE audio_link = %s) AS referenced
+            """,
+            ("media/bench-1-en.mp3", "media/bench-1-en.mp3"),
+            (),
+        ),
+    ]
+
+
+def paged_endpoints(v):
+    """
+    Returns (name, query, args, sort keys, cursor, tables allowed to be
+    scanned) for every paginated list endpoint.
+    """
+    n = v["classrooms"]
+    classroom = BASE + 1
+    student = BASE + n + 1
+    program = BASE + 1
+    return [
+        ("GET /programs", "SELECT * FROM programs", (), ("id",), (BASE + 10,), ()),
+        (
+            "GET /users",
+            "SELECT id, username, role FROM users",
+            (),
+            ("id",),
+            (BASE + 10,),
+            (),
+        ),
+        (
+            "GET /submissions/user/<id>",
+            "SELECT * FROM submissions WHERE student_id = %s",
+            (student,),
+            ("id",),
+            (10,),
+            (),
+        ),
+        (
+            "GET /quiz/program/<id>",
+            """
+            SELECT quizzes.*, users.username
+            FROM quizzes
+            JOIN users ON quizzes.student_id = users.id
+            WHERE quizzes.program_id = %s
+            """,
+            (program,),
+            ("id",),
+            (BASE + 10,),
+            ("users",),
+        ),
+        (
+            "GET /quiz/class/<id>",
+            "SELECT * FROM quizzes WHERE class_id = %s",
+            (classroom,),
+            ("id",),
+            (BASE + 10,),
+            (),
+        ),
+        (
+            "GET /chat/messages",
+            "SELECT * FROM messages WHERE user_id = %s AND program_id = %s ORDER BY sent_at ASC, id ASC",
+            (student, program),
+            ("sent_at", "id"),
+            ("2000-01-01T00:00:00", 0),
+            (),
+        ),
+    ]
+
+
+def paged(v):
+    """
+    Returns the first page and a later page of every paginated list endpoint,
+    built the way src.pagination builds them.
+    """
+    for name, query, args, keys, after, allowed in paged_endpoints(v):
+        yield f"{name}?limit", page_query(query, keys), args + (50,), allowed
+        yield f"{name}?after", page_query(query, keys, after=True), args + after + (50,), allowed
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def missing_from_source(statements):
+    """
+    Yields the names of statements that no string literal under src/ holds,
+    whitespace aside, so a query changed in a blueprint but not here is
+    reported instead of silently checking the old one.
+    """
+    source = " ".join(
+        _normalize(open(path).read())
+        for path in glob.glob(os.path.join(SERVER_DIR, "src", "**", "*.py"), recursive=True)
+    )
+    for name, query in statements:
+        literal = r"[\"'] ?" + re.escape(_normalize(query)) + r" ?;? ?[\"']"
+        if not re.search(literal, source):
+            yield name
+
+
+def seq_scans(plan):
+    """Yields the relation name of every Seq Scan node in an EXPLAIN plan."""
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def small_tables(cur):
+    cur.execute(
+        """
+        SELECT relname FROM pg_class
+        WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND relpages <= %s
+        """,
+        (SMALL_TABLE_PAGES,),
+    )
+    return {row["relname"] for row in cur.fetchall()}
+
+
+def _composable(query):
+    return query if isinstance(query, sql.Composable) else sql.SQL(query)
+
+
+def explain(cur, query, args):
+    # Savepoints keep writes and errors from leaking into the next query
+    cur.execute("SAVEPOINT bench_query")
+    try:
+        cur.execute(sql.SQL("EXPLAIN (ANALYZE, FORMAT JSON) ") + _composable(query), args)
+        result = cur.fetchone()["QUERY PLAN"]
+    finally:
+        cur.execute("ROLLBACK TO SAVEPOINT bench_query")
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the seeded volumes")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+    if not args.db_url:
+        parser.error("DB_URL is not set")
+
+    v = volumes(args.scale)
+    failures = []
+    listed = [(name, query) for name, query, _, _ in queries(v)]
+    listed += [(name, query) for name, query, _, _, _, _ in paged_endpoints(v)]
+    for name in missing_from_source(listed):
+        failures.append(name)
+        print(f"MISSING {name}: statement not found under src/, update queries()")
+
+    conn = psycopg2.connect(args.db_url, cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        with conn.cursor() as cur:
+            print(f"Seeding {v}")
+            seed(cur, v)
+            small = small_tables(cur)
+            for name, query, query_args, allowed in queries(v) + list(paged(v)):
+                try:
+                    result = explain(cur, query, query_args)
+                except psycopg2.Error as e:
+                    failures.append(name)
+                    print(f"ERROR {name}: {e}".strip())
+                    continue
+                scans = [
+                    table
+                    for table in seq_scans(result["Plan"])
+                    if table not in allowed and table not in small
+                ]
+                status = "FAIL" if scans else "ok"
+                if scans:
+                    failures.append(name)
+                detail = f" (Seq Scan on {', '.join(scans)})" if scans else ""
+                print(f"{status:4} {result['Execution Time']:9.2f} ms  {name}{detail}")
+                if args.verbose or scans:
+                    cur.execute("SAVEPOINT bench_query")
+                    cur.execute(sql.SQL("EXPLAIN ") + _composable(query), query_args)
+                    for row in cur.fetchall():
+                        print("       " + row["QUERY PLAN"])
+                    cur.execute("ROLLBACK TO SAVEPOINT bench_query")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    if failures:
+        print(f"{len(failures)} queries fall back to a sequential scan, failed or are out of date")
+        return 1
+    print("All queries use indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# Production server settings, used by `python main.py` and
+# `gunicorn -c gunicorn.conf.py src.server:app`
+import os
+import tempfile
+import multiprocessing
+
+# Workers write their metrics to files here and /metrics adds them up. It has
+# to be set before the app (and prometheus_client) is imported
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "server-metrics")
+)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5051')}"
+
+# Each worker is a process with its own database pool (up to DB_POOL_MAX
+# connections), so workers * DB_POOL_MAX must stay under Postgres'
+# max_connections
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+# Requests mostly wait on Postgres, OpenAI, Azure and Judge0, so every worker
+# serves several at once on threads
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+
+# Import the app once in the master and fork it into the workers
+preload_app = True
+
+# Chat and summary requests wait on the LLM and TTS, so allow long requests
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+# On SIGTERM, workers get this long to finish in-flight requests
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+
+
+def on_starting(server):
+    # Drop samples left over from the previous run
+    folder = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    for name in os.listdir(folder):
+        if name.endswith(".db"):
+            os.remove(os.path.join(folder, name))
+
+
+def post_fork(server, worker):
+    from src.server import warm_worker
+
+    warm_worker()
+
+
+def worker_exit(server, worker):
+    from src.server import shutdown_worker
+
+    shutdown_worker()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,3 +1,3 @@
-from src.server import main
+from src.cli import main
 
 main()
@@ -0,0 +1,15 @@
+-- 
+-- depends: 20250517_05_AnJYx
+-- Background submission jobs, see POST /submissions?async=true
+CREATE TABLE submission_jobs (
+    id TEXT PRIMARY KEY,
+    student_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    program_id INTEGER REFERENCES programs(id) ON DELETE CASCADE,
+    payload JSONB NOT NULL,
+    status TEXT CHECK (status IN ('queued', 'running', 'done', 'failed')) NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
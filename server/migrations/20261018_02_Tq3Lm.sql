@@ -0,0 +1,18 @@
+-- 
+-- depends: 20261018_01_Jb7Qw
+-- Cached LLM completions, keyed by model, prompt template version, language
+-- and a hash of the normalized code
+CREATE TABLE llm_cache (
+    cache_key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    template_version TEXT NOT NULL,
+    language TEXT NOT NULL,
+    code_hash TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE INDEX llm_cache_code_hash_idx ON llm_cache(code_hash);
+
+CREATE INDEX llm_cache_expires_at_idx ON llm_cache(expires_at);
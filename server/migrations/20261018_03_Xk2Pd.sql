@@ -0,0 +1,14 @@
+-- 
+-- depends: 20261018_02_Tq3Lm
+-- Memoized Judge0 results, keyed by normalized source hash, stdin and language
+CREATE TABLE judge_cache (
+    cache_key TEXT PRIMARY KEY,
+    code_hash TEXT NOT NULL,
+    language_id INTEGER NOT NULL,
+    result JSONB NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX judge_cache_last_used_at_idx ON judge_cache(last_used_at);
@@ -0,0 +1,29 @@
+-- 
+-- depends: 20261018_03_Xk2Pd
+-- Indexes for the filters the blueprints run on every request.
+-- bench/query_plans.py checks that none of them fall back to a Seq Scan.
+
+-- Chat history for one student and program, newest or oldest first
+CREATE INDEX messages_program_user_sent_at_idx ON messages(program_id, user_id, sent_at, id);
+
+-- Submissions by student, optionally narrowed to a program
+CREATE INDEX submissions_student_program_idx ON submissions(student_id, program_id);
+
+-- Quizzes by program, optionally narrowed to a student
+CREATE INDEX quizzes_program_student_idx ON quizzes(program_id, student_id);
+
+-- Graded quizzes of a student, best marks first
+CREATE INDEX quizzes_student_marks_idx ON quizzes(student_id, marks);
+
+-- Quizzes of a classroom, in id order for keyset pagination (src/pagination.py)
+CREATE INDEX quizzes_class_id_id_idx ON quizzes(class_id, id);
+
+CREATE INDEX programs_class_id_idx ON programs(class_id);
+
+-- Students of a classroom
+CREATE INDEX users_class_role_idx ON users(class_id, role);
+
+-- Whether an audio file is still linked before the TTS cache evicts it
+CREATE INDEX summaries_audio_link_idx ON summaries(audio_link) WHERE audio_link IS NOT NULL;
+
+CREATE INDEX messages_audio_link_idx ON messages(audio_link) WHERE audio_link IS NOT NULL;
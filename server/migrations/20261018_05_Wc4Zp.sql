@@ -0,0 +1,9 @@
+-- 
+-- depends: 20261018_04_Hn6Rv
+-- Sort keys for keyset pagination of the list endpoints, see src/pagination.py.
+-- Programs and users page by their primary key. Messages and quizzes of a
+-- classroom page by indexes from 20261018_04_Hn6Rv.
+
+CREATE INDEX submissions_student_id_id_idx ON submissions(student_id, id);
+
+CREATE INDEX quizzes_program_id_id_idx ON quizzes(program_id, id);
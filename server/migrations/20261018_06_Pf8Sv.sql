@@ -0,0 +1,9 @@
+-- 
+-- depends: 20261018_05_Wc4Zp
+-- Result of the last media sweep, so every worker can serve it at
+-- /health/media whichever process ran the sweep. Holds a single row.
+CREATE TABLE media_sweep (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    stats JSONB NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -5,14 +5,32 @@ audio_bp = Blueprint("audio", __name__)
 
 MEDIA_DIR = os.path.join(os.getcwd(), "media")
 
+# Audio files are never rewritten under the same name (uuid or content hash),
+# so clients may cache them for a year without revalidating
+AUDIO_MAX_AGE = int(os.getenv("AUDIO_MAX_AGE", str(365 * 24 * 3600)))
+
 
 @audio_bp.route("/audio/media/<path:filename>", methods=["GET"])
 def serve_mp3(filename):
+    """
+    Serves an MP3 from the media folder. Range requests get 206 partial
+    responses, If-None-Match/If-Modified-Since get 304, and the file body is
+    passed to the server's wsgi.file_wrapper so servers that support it send
+    it with sendfile(). With USE_X_SENDFILE set, the body is left to the front
+    proxy entirely.
+    """
     # Only allow .mp3 files, prevent directory traversal
     if not filename.endswith(".mp3") or ".." in filename or filename.startswith("/"):
         abort(404)
-    file_path = os.path.join(MEDIA_DIR, filename)
-    print(file_path)
-    if not os.path.isfile(file_path):
-        abort(404)
-    return send_from_directory(MEDIA_DIR, filename, mimetype="audio/mpeg")
+    # The name identifies the content, so it doubles as a strong ETag.
+    # send_from_directory raises 404 itself when the file does not exist.
+    response = send_from_directory(
+        MEDIA_DIR,
+        filename,
+        mimetype="audio/mpeg",
+        conditional=True,
+        etag=os.path.basename(filename)[: -len(".mp3")],
+        max_age=AUDIO_MAX_AGE,
+    )
+    response.cache_control.immutable = True
+    return response
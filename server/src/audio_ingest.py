@@ -0,0 +1,118 @@
+import os
+import subprocess
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# Largest accepted upload, before decoding
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Longest accepted recording
+MAX_AUDIO_SECONDS = int(os.getenv("MAX_AUDIO_SECONDS", "60"))
+
+# Format expected by the Azure speech recognizer
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AudioIngestError(Exception):
+    pass
+
+
+def decode_to_pcm(
+    stream, max_bytes=MAX_AUDIO_UPLOAD_BYTES, max_seconds=MAX_AUDIO_SECONDS
+) -> bytes:
+    """
+    Decodes an uploaded recording (any format ffmpeg understands, e.g. the
+    browser's webm) from a file-like object into raw 16 kHz mono 16-bit PCM.
+    The upload is piped through ffmpeg chunk by chunk without touching disk.
+    Raises AudioIngestError if the upload is larger than max_bytes, longer
+    than max_seconds or cannot be decoded.
+    """
+    # Decode a little past the limit so an over-long recording can be told
+    # apart from one that is exactly max_seconds long
+    max_pcm_bytes = max_seconds * SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS
+    try:
+        proc = subprocess.Popen(
+            [
+                FFMPEG_BINARY,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-i",
+                "pipe:0",
+                "-t",
+                str(max_seconds + 1),
+                "-f",
+                "s16le",
+                "-acodec",
+                "pcm_s16le",
+                "-ac",
+                str(CHANNELS),
+                "-ar",
+                str(SAMPLE_RATE),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        raise AudioIngestError(f"Audio conversion failed: {e}")
+
+    state = {"received": 0, "too_large": False}
+
+    def feed():
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                state["received"] += len(chunk)
+                if state["received"] > max_bytes:
+                    state["too_large"] = True
+                    proc.kill()
+                    break
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg stopped reading, e.g. after the duration limit
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+    errors = []
+    stderr_reader = threading.Thread(
+        target=lambda: errors.append(proc.stderr.read()), daemon=True
+    )
+    writer = threading.Thread(target=feed, daemon=True)
+    stderr_reader.start()
+    writer.start()
+
+    pcm = bytearray()
+    while True:
+        chunk = proc.stdout.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pcm.extend(chunk)
+        if len(pcm) > max_pcm_bytes:
+            proc.kill()
+            break
+    writer.join()
+    proc.wait()
+    stderr_reader.join()
+
+    if state["too_large"]:
+        raise AudioIngestError(f"Audio upload is larger than {max_bytes} bytes")
+    if len(pcm) > max_pcm_bytes:
+        raise AudioIngestError(f"Audio is longer than {max_seconds} seconds")
+    if proc.returncode != 0 or not pcm:
+        message = b"".join(errors).decode("utf-8", "replace").strip()
+        raise AudioIngestError(f"Audio conversion failed: {message or 'no audio'}")
+    return bytes(pcm)
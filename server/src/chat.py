@@ -1,47 +1,92 @@
-import os
-import uuid
-from flask import Blueprint, request, jsonify
-from werkzeug.utils import secure_filename
-from .db import query_db
-from .chatbot.voice import chatbot_speech_helper
-
-from pydub import AudioSegment
+import io
+import json
 import base64
+from flask import Blueprint, Response, request, jsonify
+from .db import query_db, bulk_insert
+from .pagination import paginated
+from . import chat_cache
+from .chat_cache import CHAT_HISTORY_LENGTH
+from .audio_ingest import AudioIngestError, decode_to_pcm
+from .chatbot.voice import chatbot_speech_helper, chatbot_speech_stream, get_user_text
 
 chat_bp = Blueprint("chat", __name__)
-os.makedirs("temp", exist_ok=True)
 
 
-def save_as_wav(uploaded_file, out_path):
-    temp_path = out_path + ".tmp"
-    uploaded_file.save(temp_path)
-    try:
-        audio = AudioSegment.from_file(temp_path)
-        audio.export(out_path, format="wav")
-        os.remove(temp_path)
-        return out_path
-    except Exception as e:
-        os.remove(temp_path)
-        raise RuntimeError(f"Audio conversion failed: {e}")
-
-
-def get_previous_messages(program_id, user_id, limit=10):
-    messages = query_db(
-        """
-        SELECT content, "from", sent_at FROM messages
-        WHERE program_id = %s AND user_id = %s
-        ORDER BY sent_at DESC LIMIT %s
-        """,
-        (program_id, user_id, limit),
-    )
-    return list(reversed(messages))
+def get_previous_messages(program_id, user_id):
+    """The last CHAT_HISTORY_LENGTH messages of the conversation, oldest first."""
+
+    def load():
+        messages = query_db(
+            """
+            SELECT content, "from", sent_at FROM messages
+            WHERE program_id = %s AND user_id = %s
+            ORDER BY sent_at DESC, id DESC LIMIT %s
+            """,
+            (program_id, user_id, CHAT_HISTORY_LENGTH),
+        )
+        return list(reversed(messages))
+
+    return chat_cache.recent_messages(program_id, user_id, load)
 
 
 def get_actual_program(program_id):
-    prog = query_db("SELECT * FROM programs WHERE id = %s", (program_id,), one=True)
-    if not prog:
-        return ""
-    return prog.get("code", "")
+    def load():
+        prog = query_db("SELECT code FROM programs WHERE id = %s", (program_id,), one=True)
+        if not prog:
+            return ""
+        return prog.get("code", "")
+
+    return chat_cache.program_code(program_id, load)
+
+
+def save_messages(program_id, user_id, user_text, bot_reply=None, audio_path=None):
+    """
+    Saves a student message and, if there is one, the bot reply to it in a
+    single multi-row INSERT, and adds them to the cached conversation.
+    """
+    rows = [(program_id, user_id, user_text, "student", None)]
+    if bot_reply is not None:
+        rows.append((program_id, user_id, bot_reply, "bot", audio_path))
+    saved = bulk_insert(
+        "messages",
+        ["program_id", "user_id", "content", "from", "audio_link"],
+        rows,
+        returning=["content", "from", "sent_at"],
+    )
+    chat_cache.append_messages(program_id, user_id, saved)
+
+
+def _get_fields():
+    # Prefer form fields if present
+    if request.form or request.files:
+        return request.form
+    if request.is_json:
+        return request.get_json()
+    return None
+
+
+def _get_input_text(fields, language):
+    """
+    Returns (user_text, error) from the text field, an uploaded audio file or
+    audio_base64. Audio is decoded and transcribed in memory.
+    """
+    if "text" in fields:
+        return fields["text"], None
+    if "audio" in request.files:
+        stream = request.files["audio"].stream
+    elif "audio_base64" in fields:
+        try:
+            stream = io.BytesIO(base64.b64decode(fields["audio_base64"]))
+        except Exception as e:
+            return None, f"Audio decode failed: {e}"
+    else:
+        return None, "No valid input provided"
+
+    try:
+        pcm = decode_to_pcm(stream)
+    except AudioIngestError as e:
+        return None, str(e)
+    return get_user_text(audio_pcm=pcm, language=language)
 
 
 @chat_bp.route("/chat/message", methods=["POST"])
@@ -50,186 +95,129 @@ def chat_message():
     Accepts a message as text or audio.
     Saves it to the messages table for later processing.
     Expects: user_id, program_id, and either text or audio (multipart/form-data or JSON).
+    Audio messages are stored as their transcript.
     Returns: bot reply in text and audio.
     """
     try:
-        # Prefer form fields if present
-        if request.form:
-            user_id = request.form.get("user_id")
-            program_id = request.form.get("program_id")
-            language = request.form.get("language") or "en"
-            if not user_id or not program_id:
-                return jsonify({"error": "user_id and program_id required"}), 400
-            prev_messages = get_previous_messages(program_id, user_id)
-            actual_program = get_actual_program(program_id)
-
-            if "text" in request.form:
-                user_text = request.form["text"]
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from") VALUES (%s, %s, %s, %s) RETURNING program_id',
-                    (program_id, user_id, user_text, "student"),
-                    commit=True,
-                )
-                bot_result = chatbot_speech_helper(
-                    text=user_text,
-                    language=language,
-                    previous_messages=prev_messages,
-                    actual_program=actual_program,
-                )
-                if "error" in bot_result:
-                    return jsonify({"error": bot_result["error"]}), 400
-                # Save bot reply and audio link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from", audio_link) VALUES (%s, %s, %s, %s, %s) RETURNING program_id',
-                    (
-                        program_id,
-                        user_id,
-                        bot_result["bot_reply"],
-                        "bot",
-                        bot_result.get("audio_reply_path"),
-                    ),
-                    commit=True,
-                )
-                return jsonify(bot_result)
-
-            if "audio" in request.files:
-                audio_file = request.files["audio"]
-                filename = f"{uuid.uuid4()}.wav"
-                filepath = os.path.join("temp", secure_filename(filename))
-                try:
-                    save_as_wav(audio_file, filepath)
-                except Exception as e:
-                    return jsonify({"error": str(e)}), 400
-
-                # Save student audio as content, no audio_link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from") VALUES (%s, %s, %s, %s) RETURNING program_id',
-                    (program_id, user_id, filepath, "student"),
-                    commit=True,
-                )
-
-                bot_result = chatbot_speech_helper(
-                    audio_file_path=filepath,
-                    language=language,
-                    previous_messages=prev_messages,
-                    actual_program=actual_program,
-                )
-                if "error" in bot_result:
-                    return jsonify({"error": bot_result["error"]}), 400
-                # Save bot reply and audio link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from", audio_link) VALUES (%s, %s, %s, %s, %s) RETURNING program_id',
-                    (
-                        program_id,
-                        user_id,
-                        bot_result["bot_reply"],
-                        "bot",
-                        bot_result.get("audio_reply_path"),
-                    ),
-                    commit=True,
-                )
-                return jsonify(bot_result)
-
+        fields = _get_fields()
+        if fields is None:
             return jsonify({"error": "No valid input provided"}), 400
+        user_id = fields.get("user_id")
+        program_id = fields.get("program_id")
+        language = fields.get("language") or "en"
+        if not user_id or not program_id:
+            return jsonify({"error": "user_id and program_id required"}), 400
+        prev_messages = get_previous_messages(program_id, user_id)
+        actual_program = get_actual_program(program_id)
+
+        user_text, error = _get_input_text(fields, language)
+        if error:
+            return jsonify({"error": error}), 400
+
+        bot_result = {}
+        try:
+            bot_result = chatbot_speech_helper(
+                text=user_text,
+                language=language,
+                previous_messages=prev_messages,
+                actual_program=actual_program,
+            )
+        finally:
+            # Save the student message, and the bot reply and audio link if any
+            save_messages(
+                program_id,
+                user_id,
+                user_text,
+                bot_result.get("bot_reply"),
+                bot_result.get("audio_reply_path"),
+            )
+        if "error" in bot_result:
+            return jsonify({"error": bot_result["error"]}), 400
+        return jsonify(bot_result)
 
-        # If JSON, handle as before
-        if request.is_json:
-            data = request.get_json()
-            user_id = data.get("user_id")
-            program_id = data.get("program_id")
-            language = data.get("language", "en")
-            if not user_id or not program_id:
-                return jsonify({"error": "user_id and program_id required"}), 400
-            prev_messages = get_previous_messages(program_id, user_id)
-            actual_program = get_actual_program(program_id)
-
-            if "text" in data:
-                user_text = data["text"]
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from") VALUES (%s, %s, %s, %s) RETURNING program_id',
-                    (program_id, user_id, user_text, "student"),
-                    commit=True,
-                )
-                bot_result = chatbot_speech_helper(
-                    text=user_text,
-                    language=language,
-                    previous_messages=prev_messages,
-                    actual_program=actual_program,
-                )
-                if "error" in bot_result:
-                    return jsonify({"error": bot_result["error"]}), 400
-                # Save bot reply and audio link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from", audio_link) VALUES (%s, %s, %s, %s, %s) RETURNING program_id',
-                    (
-                        program_id,
-                        user_id,
-                        bot_result["bot_reply"],
-                        "bot",
-                        bot_result.get("audio_reply_path"),
-                    ),
-                    commit=True,
-                )
-                return jsonify(bot_result)
-
-            if "audio_base64" in data:
-                try:
-                    audio_bytes = base64.b64decode(data["audio_base64"])
-                    filename = f"{uuid.uuid4()}.wav"
-                    filepath = os.path.join("temp", filename)
-                    with open(filepath, "wb") as f:
-                        f.write(audio_bytes)
-                except Exception as e:
-                    return jsonify({"error": f"Audio decode failed: {e}"}), 400
-
-                # Save student audio as content, no audio_link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from") VALUES (%s, %s, %s, %s) RETURNING program_id',
-                    (program_id, user_id, filepath, "student"),
-                    commit=True,
-                )
-                bot_result = chatbot_speech_helper(
-                    audio_file_path=filepath,
-                    language=language,
-                    previous_messages=prev_messages,
-                    actual_program=actual_program,
-                )
-                if "error" in bot_result:
-                    return jsonify({"error": bot_result["error"]}), 400
-                # Save bot reply and audio link
-                query_db(
-                    'INSERT INTO messages (program_id, user_id, content, "from", audio_link) VALUES (%s, %s, %s, %s, %s) RETURNING program_id',
-                    (
-                        program_id,
-                        user_id,
-                        bot_result["bot_reply"],
-                        "bot",
-                        bot_result.get("audio_reply_path"),
-                    ),
-                    commit=True,
-                )
-                return jsonify(bot_result)
+    except Exception as e:
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
-            return jsonify({"error": "No valid input provided"}), 400
 
-        return jsonify({"error": "No valid input provided"}), 400
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    except Exception as e:
-        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+@chat_bp.route("/chat/message/stream", methods=["POST"])
+def chat_message_stream():
+    """
+    Streaming version of /chat/message, answered as Server-Sent Events.
+    Accepts the same fields (form or JSON, text or audio) and emits:
+    user_text, then token events as the reply is generated, reply with the full
+    text, audio once text-to-speech is done, and finally done. On failure an
+    error event is sent instead. The student message and bot reply are saved
+    together when the stream ends.
+    """
+    fields = _get_fields()
+    if fields is None:
+        return jsonify({"error": "No valid input provided"}), 400
+    user_id = fields.get("user_id")
+    program_id = fields.get("program_id")
+    language = fields.get("language") or "en"
+    if not user_id or not program_id:
+        return jsonify({"error": "user_id and program_id required"}), 400
+    prev_messages = get_previous_messages(program_id, user_id)
+    actual_program = get_actual_program(program_id)
+
+    user_text, error = _get_input_text(fields, language)
+    if error:
+        return jsonify({"error": error}), 400
+
+    def generate():
+        bot_reply = None
+        audio_path = None
+        failed = False
+        try:
+            for event, data in chatbot_speech_stream(
+                text=user_text,
+                language=language,
+                previous_messages=prev_messages,
+                actual_program=actual_program,
+            ):
+                if event == "reply":
+                    bot_reply = data["bot_reply"]
+                elif event == "audio":
+                    audio_path = data["audio_reply_path"]
+                elif event == "error":
+                    failed = True
+                yield _sse(event, data)
+        except Exception as e:
+            failed = True
+            yield _sse("error", {"error": f"Internal server error: {str(e)}"})
+        finally:
+            # Save the student message with whatever reply was produced, even
+            # if text-to-speech failed or the client went away
+            save_messages(program_id, user_id, user_text, bot_reply, audio_path)
+        if not failed:
+            yield _sse(
+                "done", {"bot_reply": bot_reply, "audio_reply_path": audio_path}
+            )
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @chat_bp.route("/chat/messages", methods=["GET"])
 def get_messages():
     """
-    Fetch all messages for a given user_id and program_id.
-    Expects user_id and program_id as query parameters.
+    Fetch all messages for a given user_id and program_id, oldest first.
+    Expects user_id and program_id as query parameters; limit and after page
+    through them.
     """
     user_id = request.args.get("user_id")
     program_id = request.args.get("program_id")
     if not user_id or not program_id:
         return jsonify({"error": "user_id and program_id required"}), 400
-    messages = query_db(
-        "SELECT * FROM messages WHERE user_id = %s AND program_id = %s ORDER BY sent_at ASC",
+    return paginated(
+        "SELECT * FROM messages WHERE user_id = %s AND program_id = %s ORDER BY sent_at ASC, id ASC",
         (user_id, program_id),
+        keys=("sent_at", "id"),
     )
-    return jsonify(messages)
@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Programs whose code is kept in memory for the chat tutor
+PROGRAM_CACHE_SIZE = int(os.getenv("PROGRAM_CACHE_SIZE", "256"))
+# Invalidations only reach the worker that made them, so entries also expire
+# to pick up changes made through other workers
+PROGRAM_CACHE_TTL = float(os.getenv("PROGRAM_CACHE_TTL", "300"))
+# Conversations (program, student) whose recent messages are kept in memory
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "2048"))
+# A turn served by another worker is missing from this worker's copy of the
+# conversation for at most this long, counted from when it was loaded
+CHAT_HISTORY_CACHE_TTL = float(os.getenv("CHAT_HISTORY_CACHE_TTL", "30"))
+# Previous messages sent to the LLM as context
+CHAT_HISTORY_LENGTH = int(os.getenv("CHAT_HISTORY_LENGTH", "10"))
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache that evicts the least recently used entry
+    once it holds max_entries, and drops entries ttl seconds after they were
+    loaded. A size or ttl of 0 turns it off.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        # Bumped by every change, so a load that raced with one is not stored
+        self._version = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get_or_load(self, key, load):
+        """Returns the cached value for key, or load() and caches it."""
+        if not self.enabled:
+            return load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self._version
+
+        value = load()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def update(self, key, fn):
+        """
+        Replaces the cached value for key, if any, with fn(value). The entry
+        still expires ttl seconds after it was loaded.
+        """
+        with self._lock:
+            self._version += 1
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries[key] = (entry[0], fn(entry[1]))
+
+    def discard(self, predicate):
+        """Drops every entry whose key matches predicate(key)."""
+        with self._lock:
+            self._version += 1
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+programs = LRUCache(PROGRAM_CACHE_SIZE, PROGRAM_CACHE_TTL)
+conversations = LRUCache(CHAT_HISTORY_CACHE_SIZE, CHAT_HISTORY_CACHE_TTL)
+
+
+def _id(value):
+    # Ids arrive as ints from JSON bodies and as strings from forms
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def program_code(program_id, load):
+    """The code of a program, from the cache or load()."""
+    key = _id(program_id)
+    if key is None:
+        return load()
+    return programs.get_or_load(key, load)
+
+
+def recent_messages(program_id, user_id, load):
+    """
+    The last CHAT_HISTORY_LENGTH messages of a conversation, oldest first,
+    from the cache or load().
+    """
+    key = (_id(program_id), _id(user_id))
+    if None in key:
+        return load()
+    return list(conversations.get_or_load(key, load))
+
+
+def append_messages(program_id, user_id, messages):
+    """Adds newly saved messages to the conversation, if it is cached."""
+    key = (_id(program_id), _id(user_id))
+    if None in key:
+        return
+    conversations.update(key, lambda cached: (list(cached) + list(messages))[-CHAT_HISTORY_LENGTH:])
+
+
+def invalidate_program(program_id, messages=False):
+    """
+    Forgets a program's code, and with messages set the conversations about
+    it as well (e.g. when it is deleted).
+    """
+    key = _id(program_id)
+    programs.discard(lambda cached: cached == key)
+    if messages:
+        conversations.discard(lambda cached: cached[0] == key)
+
+
+def stats():
+    return {"program_code": programs.stats(), "conversations": conversations.stats()}
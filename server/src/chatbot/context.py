@@ -0,0 +1,207 @@
+import os
+import re
+import math
+import threading
+from dotenv import load_dotenv
+from .. import metrics
+from ..sweeper import TEMP_DIR
+
+load_dotenv()
+
+# Most prompt tokens sent for one chat turn: system prompt with the program,
+# previous messages and the question
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "2000"))
+# Most of the above spent on the program; longer programs are cut down to the
+# parts that relate to the question
+CHAT_PROGRAM_TOKEN_BUDGET = int(os.getenv("CHAT_PROGRAM_TOKEN_BUDGET", "1000"))
+
+# Lines per program chunk, when a block between blank lines is longer
+CHUNK_LINES = 12
+# Tokens the chat API adds per message, and to prime the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# Words too common in questions to say which part of a program they are about
+STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "can", "code", "do", "does", "for",
+    "how", "i", "in", "is", "it", "me", "my", "not", "of", "on", "or",
+    "program", "the", "this", "to", "what", "when", "where", "which", "why",
+    "with", "you",
+}
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    """The tiktoken encoding for model, or None if tiktoken is not available."""
+    try:
+        return _encodings[model]
+    except KeyError:
+        pass
+    # Only the first call per model loads the encoding
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # Not installed, or its encoding files cannot be downloaded
+                print("Counting tokens approximately:", e)
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    Number of tokens in text, exact with tiktoken and otherwise estimated:
+    about four ASCII characters per token, and one per other character
+    (e.g. Kannada), which errs on the high side.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+def _message_tokens(message, model):
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD
+
+
+def is_audio_placeholder(content):
+    # Older audio messages were saved as the path of the recording
+    return content.startswith(TEMP_DIR + "/")
+
+
+def _words(text):
+    return {word.lower() for word in WORD.findall(text)} - STOPWORDS
+
+
+def _chunks(program):
+    """Splits a program into blocks between blank lines, at most CHUNK_LINES long."""
+    chunks = []
+    block = []
+    for line in program.splitlines():
+        if line.strip():
+            block.append(line)
+            if len(block) < CHUNK_LINES:
+                continue
+        if block:
+            chunks.append("\n".join(block))
+            block = []
+    if block:
+        chunks.append("\n".join(block))
+    return chunks
+
+
+def _truncate(text, budget, model):
+    """The longest start of text within budget tokens, cut at a line end if possible."""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle], model) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    head = text[:low]
+    if "\n" in head:
+        head = head[: head.rindex("\n")]
+    return head
+
+
+def relevant_program(program, question, budget=CHAT_PROGRAM_TOKEN_BUDGET, model="gpt-3.5-turbo"):
+    """
+    Returns program if it fits in budget tokens. Otherwise keeps the chunks
+    that share the most identifiers with question, in program order, with
+    "..." marking what was left out. The first chunk (usually includes and
+    declarations) wins ties, then earlier chunks. If the best chunk does not
+    fit on its own (e.g. one long function), its start is kept instead.
+    """
+    if count_tokens(program, model) <= budget:
+        return program
+    chunks = _chunks(program)
+    wanted = _words(question)
+    ranked = sorted(
+        range(len(chunks)),
+        key=lambda i: (-(len(_words(chunks[i]) & wanted) + (0.5 if i == 0 else 0)), i),
+    )
+    marker = count_tokens("\n...\n", model)
+    kept = set()
+    used = 0
+    for i in ranked:
+        cost = count_tokens(chunks[i], model) + marker
+        if used + cost <= budget:
+            kept.add(i)
+            used += cost
+        elif not kept:
+            chunks[i] = _truncate(chunks[i], budget - 2 * marker, model) + "\n..."
+            kept.add(i)
+            used += count_tokens(chunks[i], model) + marker
+
+    parts = []
+    for i, chunk in enumerate(chunks):
+        if i in kept:
+            parts.append(chunk)
+        elif not parts or not parts[-1].endswith("..."):
+            parts.append("...")
+    return "\n".join(parts)
+
+
+def build_context(
+    user_text,
+    previous_messages,
+    actual_program,
+    system_prompt,
+    model="gpt-3.5-turbo",
+    budget=CHAT_PROMPT_TOKEN_BUDGET,
+):
+    """
+    Builds the GPT messages for a chat turn within budget prompt tokens:
+    system_prompt(program) with the program cut down by relevant_program(),
+    then as many of the most recent previous messages as still fit, and the
+    question. Audio placeholders are left out, and older messages are
+    dropped first. The question is always sent, even if it is over budget
+    on its own. Logs and records the prompt's size.
+    """
+    question = {"role": "user", "content": user_text}
+    history = [
+        {"role": "assistant" if msg["from"] == "bot" else "user", "content": msg["content"]}
+        for msg in previous_messages or []
+        if msg["content"] and not is_audio_placeholder(msg["content"])
+    ]
+
+    # The last exchange often names what the question ("why?") is about
+    recent = " ".join(message["content"] for message in history[-2:])
+    program = relevant_program(
+        actual_program or "",
+        f"{user_text} {recent}",
+        min(CHAT_PROGRAM_TOKEN_BUDGET, budget),
+        model,
+    )
+    system = {"role": "system", "content": system_prompt(program)}
+
+    used = _message_tokens(system, model) + _message_tokens(question, model) + REPLY_OVERHEAD
+    kept = []
+    for message in reversed(history):
+        cost = _message_tokens(message, model)
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    print(
+        f"Chat prompt: {used} tokens (budget {budget}), program "
+        f"{count_tokens(program, model)} of {count_tokens(actual_program or '', model)}, "
+        f"{len(kept)} of {len(previous_messages or [])} previous messages"
+    )
+    metrics.PROMPT_TOKENS.labels(model=model).observe(used)
+    return [system] + kept + [question]
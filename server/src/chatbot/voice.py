@@ -1,12 +1,13 @@
-import os
-import uuid
-import openai
-import azure.cognitiveservices.speech as speechsdk  # type: ignore
 from dotenv import load_dotenv
+from ..ai import synthesize_speech_to_unique_mp3
+from .. import speech
+from ..clients import chat_completion, speechsdk
+from ..audio_ingest import SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+from .context import build_context
 
 load_dotenv()
 
-client = openai.OpenAI(api_key=os.getenv("CHATGPT_API_KEY"))
+CHAT_MODEL = "gpt-3.5-turbo"
 
 languages = {
     "en": "English",
@@ -23,6 +24,80 @@ voices = {
 }
 
 
+def get_user_text(
+    audio_file_path: str = None,
+    text: str = None,
+    audio_pcm: bytes = None,
+    language: str = "en",
+):
+    """
+    Returns (user_text, error) from either a recorded audio file, raw 16 kHz
+    mono 16-bit PCM audio or direct text.
+    """
+    if audio_pcm:
+        sdk = speechsdk()
+        # Feed the decoded audio straight from memory
+        stream_format = sdk.audio.AudioStreamFormat(
+            samples_per_second=SAMPLE_RATE,
+            bits_per_sample=SAMPLE_WIDTH * 8,
+            channels=CHANNELS,
+        )
+        push_stream = sdk.audio.PushAudioInputStream(stream_format)
+        push_stream.write(audio_pcm)
+        push_stream.close()
+        return speech.recognize(
+            sdk.audio.AudioConfig(stream=push_stream), language
+        )
+    elif audio_file_path:
+        sdk = speechsdk()
+        return speech.recognize(
+            sdk.audio.AudioConfig(filename=audio_file_path), language
+        )
+    elif text:
+        return text.strip(), None
+    return None, "No input provided"
+
+
+def build_messages(
+    user_text: str,
+    language: str = "ka",
+    previous_messages: list = None,
+    actual_program: str = "",
+) -> list:
+    """
+    Builds the GPT messages: system prompt with the relevant part of the
+    program, as many previous messages as fit for context and the current
+    user message, within CHAT_PROMPT_TOKEN_BUDGET tokens.
+    """
+    print("Language:", languages[language])
+
+    def system_prompt(program):
+        return (
+            f"{program} Above is the actual program. \n"
+            # f"{user_program} Above is the program written by the user\n"
+            f"You are a helpful coding assistant. Do NOT give full solutions or entire code. "
+            f"Instead, reply with a short, helpful *hint, **syntax help, or **concept explanation* in simple and spoken {language}.\n"
+            f"Your response should:\n"
+            f"- NOT reveal complete code\n"
+            f"- Be gentle and encouraging\n"
+            f"- Be only 2–3 sentences\n"
+            f"- Be in very simple, conversational {languages[language]}\n"
+            f"Reply only with the helpful response in {languages[language]}."
+        )
+
+    return build_context(
+        user_text, previous_messages, actual_program, system_prompt, model=CHAT_MODEL
+    )
+
+
+def synthesize_reply(bot_reply: str, language: str = "ka") -> str:
+    return synthesize_speech_to_unique_mp3(
+        bot_reply,
+        voice=voices[language] if language in voices else "en-IN-NeerjaNeural",
+        output_folder="media",
+    )
+
+
 def chatbot_speech_helper(
     audio_file_path: str = None,
     text: str = None,
@@ -34,91 +109,68 @@ def chatbot_speech_helper(
     """
     Handles both audio and text input, uses previous messages for context, and returns both text and audio reply.
     """
-    # Azure credentials
-    speech_key = os.getenv("AZURE_SPEECH_KEY")
-    service_region = os.getenv("AZURE_REGION")
-
     # Step 1: Get user_text from audio or direct text
-    user_text = ""
-    if audio_file_path:
-        speech_config = speechsdk.SpeechConfig(
-            subscription=speech_key, region=service_region
-        )
-        audio_config = speechsdk.audio.AudioConfig(filename=audio_file_path)
-        recognizer = speechsdk.SpeechRecognizer(
-            speech_config=speech_config, audio_config=audio_config
-        )
-        result = recognizer.recognize_once()
-        if result.reason != speechsdk.ResultReason.RecognizedSpeech:
-            return {"error": f"Speech recognition failed: {result.reason}"}
-        user_text = result.text.strip()
-    elif text:
-        user_text = text.strip()
-    else:
-        return {"error": "No input provided"}
+    user_text, error = get_user_text(audio_file_path, text, language=language)
+    if error:
+        return {"error": error}
 
     # Step 2: Build GPT prompt/messages with context
-    messages = []
-    if previous_messages:
-        for msg in previous_messages:
-            role = "assistant" if msg["from"] == "bot" else "user"
-            messages.append({"role": role, "content": msg["content"]})
-    # Add the current user message
-    messages.append({"role": "user", "content": user_text})
-
-    print("Language:", languages[language])
-
-    # System prompt
-    system_prompt = (
-        f"{actual_program} Above is the actual program. \n"
-        # f"{user_program} Above is the program written by the user\n"
-        f"You are a helpful coding assistant. Do NOT give full solutions or entire code. "
-        f"Instead, reply with a short, helpful *hint, **syntax help, or **concept explanation* in simple and spoken {language}.\n"
-        f"Your response should:\n"
-        f"- NOT reveal complete code\n"
-        f"- Be gentle and encouraging\n"
-        f"- Be only 2–3 sentences\n"
-        f"- Be in very simple, conversational {languages[language]}\n"
-        f"Reply only with the helpful response in {languages[language]}."
-    )
-    messages = [{"role": "system", "content": system_prompt}] + messages
+    messages = build_messages(user_text, language, previous_messages, actual_program)
 
     # Step 3: GPT-based hint generation
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo", messages=messages, temperature=0.6
+    response = chat_completion(
+        model=CHAT_MODEL, messages=messages, temperature=0.6
     )
     bot_reply = response.choices[0].message.content.strip()
 
     # Step 4: Text-to-speech
-    os.makedirs("media", exist_ok=True)
-    output_path = f"media/{uuid.uuid4()}.mp3"
-
-    speech_config = speechsdk.SpeechConfig(
-        subscription=speech_key, region=service_region
-    )
-    speech_config.speech_synthesis_voice_name = (
-        voices[language] if language in voices else "en-IN-NeerjaNeural"
-    )
-    speech_config.set_speech_synthesis_output_format(
-        speechsdk.SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
-    )
-    audio_output_config = speechsdk.audio.AudioConfig(filename=output_path)
-    synthesizer = speechsdk.SpeechSynthesizer(
-        speech_config=speech_config, audio_config=audio_output_config
-    )
-    result = synthesizer.speak_text_async(bot_reply).get()
-
-    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-        print(f"Speech synthesized and saved to: {output_path}")
-    elif result.reason == speechsdk.ResultReason.Canceled:
-        cancellation_details = result.cancellation_details
-        print(f"Speech synthesis canceled: {cancellation_details.reason}")
-        if cancellation_details.reason == speechsdk.CancellationReason.Error:
-            print(f"Error details: {cancellation_details.error_details}")
-        return ""
+    output_path = synthesize_reply(bot_reply, language)
+    if not output_path:
+        return {"error": "Speech synthesis failed"}
 
     return {
         "user_text": user_text,
         "bot_reply": bot_reply,
         "audio_reply_path": output_path,
     }
+
+
+def chatbot_speech_stream(
+    audio_file_path: str = None,
+    text: str = None,
+    language: str = "ka",
+    previous_messages: list = None,
+    actual_program: str = "",
+):
+    """
+    Streaming version of chatbot_speech_helper. Yields (event, data) pairs:
+    "user_text" once the input is known, "token" for every piece of the reply
+    as GPT produces it, "reply" with the full reply, then "audio" with the
+    audio path once text-to-speech is done. Yields "error" and stops on failure.
+    """
+    user_text, error = get_user_text(audio_file_path, text, language=language)
+    if error:
+        yield "error", {"error": error}
+        return
+    yield "user_text", {"user_text": user_text}
+
+    messages = build_messages(user_text, language, previous_messages, actual_program)
+    stream = chat_completion(
+        model=CHAT_MODEL, messages=messages, temperature=0.6, stream=True
+    )
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield "token", {"text": delta}
+    bot_reply = "".join(parts).strip()
+    yield "reply", {"bot_reply": bot_reply}
+
+    output_path = synthesize_reply(bot_reply, language)
+    if not output_path:
+        yield "error", {"error": "Speech synthesis failed"}
+        return
+    yield "audio", {"audio_reply_path": output_path}
@@ -0,0 +1,58 @@
+import os
+import argparse
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5051"))
+
+GUNICORN_CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py"
+)
+
+
+def run_dev():
+    from .server import app
+    from .sweeper import start_sweeper
+
+    # With the reloader on, this runs in a watcher process and again in every
+    # serving child it starts; only the current child sweeps
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_sweeper()
+    app.run(debug=True, port=PORT, host=HOST, threaded=True)
+
+
+def run_production(on_load=None):
+    """
+    Serves the app with gunicorn. on_load() is called in the master right
+    after the app is imported, before the workers are forked.
+    """
+    # Imported here so the dev server works without gunicorn installed
+    from gunicorn.app.base import Application
+
+    class ProductionServer(Application):
+        def load_config(self):
+            self.load_config_from_file(GUNICORN_CONFIG)
+
+        def load(self):
+            # Only imported once gunicorn.conf.py has set up the environment
+            # the workers share, e.g. PROMETHEUS_MULTIPROC_DIR
+            from .server import app
+
+            if on_load is not None:
+                on_load()
+            return app
+
+    ProductionServer().run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the Flask API server.")
+    parser.add_argument(
+        "--dev",
+        action="store_true",
+        help="run the Werkzeug development server with the debugger and reloader",
+    )
+    args = parser.parse_args(argv)
+    if args.dev:
+        run_dev()
+    else:
+        run_production()
@@ -0,0 +1,70 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from . import metrics
+
+load_dotenv()
+
+# The openai and Azure Speech SDKs take most of the app's import time, so they
+# are only imported, and their clients only built, when first used
+
+_lock = threading.Lock()
+_openai_client = None
+
+
+def openai_client():
+    """Returns the process-wide OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                import openai
+
+                _openai_client = openai.OpenAI(api_key=os.getenv("CHATGPT_API_KEY"))
+    return _openai_client
+
+
+def chat_completion(**kwargs):
+    """
+    openai_client().chat.completions.create(**kwargs), timed by model. For
+    stream=True the returned iterator is timed until its last chunk.
+    """
+    model = kwargs.get("model", "")
+    if not kwargs.get("stream"):
+        with metrics.timed(metrics.LLM_LATENCY, model=model, stream="false"):
+            return openai_client().chat.completions.create(**kwargs)
+
+    start = time.perf_counter()
+    try:
+        stream = openai_client().chat.completions.create(**kwargs)
+    except Exception:
+        _observe_stream(model, start, "error")
+        raise
+    return _timed_stream(stream, model, start)
+
+
+def _observe_stream(model, start, outcome):
+    metrics.observe(
+        metrics.LLM_LATENCY,
+        time.perf_counter() - start,
+        model=model,
+        stream="true",
+        outcome=outcome,
+    )
+
+
+def _timed_stream(stream, model, start):
+    outcome = "error"
+    try:
+        yield from stream
+        outcome = "ok"
+    finally:
+        _observe_stream(model, start, outcome)
+
+
+def speechsdk():
+    """Returns the azure.cognitiveservices.speech module, importing it on first use."""
+    import azure.cognitiveservices.speech as sdk  # type: ignore
+
+    return sdk
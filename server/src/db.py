@@ -1,34 +1,360 @@
 import os
+import time
+import uuid
+import threading
 import psycopg2
+import psycopg2.extras
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
+from dotenv import load_dotenv
+from . import metrics
+
+load_dotenv()
 
 DB_URL = os.getenv("DB_URL")
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Seconds a checkout waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Idle connections above DB_POOL_MIN are closed after this many seconds
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))
+# Rows fetched per round trip by stream_query
+DB_STREAM_FETCH_SIZE = int(os.getenv("DB_STREAM_FETCH_SIZE", "1000"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are created lazily up to max_size, pinged on checkout when they
+    have been idle for a while, thrown away when they break, and closed when
+    they sit idle above min_size for longer than idle_timeout.
+    """
+
+    def __init__(
+        self,
+        dsn,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+        idle_timeout=DB_POOL_IDLE_TIMEOUT,
+        check_after=DB_POOL_CHECK_AFTER,
+    ):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._size = 0  # open connections, idle or in use
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.reaped = 0
+
+        # Forked workers (e.g. gunicorn with preload_app) must not share the
+        # parent's sockets
+        self._inherited = []
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent still owns its connections: keep references so they are
+        # never closed (and terminated server side) from the child, and start
+        # over with a fresh lock in case another thread held it during fork
+        self._inherited.extend(conn for conn, _ in self._idle)
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _reap(self):
+        # Called with the lock held
+        now = time.monotonic()
+        keep = []
+        for conn, last_used in self._idle:
+            if self._size > self.min_size and now - last_used > self.idle_timeout:
+                self._close(conn)
+                self._size -= 1
+                self.reaped += 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def getconn(self):
+        start = time.monotonic()
+        waited = False
+        while True:
+            with self._cond:
+                self._reap()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                else:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                    continue
+
+            # Health checks and connects happen outside the lock
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._close(conn)
+                with self._cond:
+                    self._size -= 1
+                    self.recycled += 1
+                continue
+
+            with self._cond:
+                if last_used is None:
+                    self.created += 1
+                self.checkouts += 1
+                if waited:
+                    self.waits += 1
+                    self.wait_time += time.monotonic() - start
+            return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken or conn.closed:
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self.recycled += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def warm(self):
+        """Opens connections until min_size are available."""
+        conns = []
+        try:
+            while self._size < self.min_size:
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+                self._size -= 1
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": round(self.wait_time, 6),
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "recycled": self.recycled,
+                "reaped": self.reaped,
+            }
+
+
+pool = ConnectionPool(DB_URL)
+
 
 @contextmanager
 def get_db():
-    conn = psycopg2.connect(DB_URL, cursor_factory=RealDictCursor)
-    try:
+    with pool.connection() as conn:
         yield conn
-    finally:
-        conn.close()
+
+
+def _statement(query, conn):
+    # Composed queries (psycopg2.sql) are recorded by their rendered text
+    if not isinstance(query, str):
+        query = query.as_string(conn)
+    return metrics.statement_label(query)
 
 
 def query_db(query, args=(), one=False, commit=False):
-    conn = psycopg2.connect(DB_URL)
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute(query, args)
-    if commit:
-        if one:
-            result = cur.fetchone()
-        else:
-            result = cur.fetchall()
-        conn.commit()
-    else:
-        if one:
-            result = cur.fetchone()
-        else:
-            result = cur.fetchall()
-    conn.close()
+    with pool.connection() as conn:
+        with metrics.timed(metrics.DB_QUERY_LATENCY, statement=_statement(query, conn)):
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(query, args)
+            if one:
+                result = cur.fetchone()
+            else:
+                result = cur.fetchall()
+            if commit:
+                conn.commit()
+            cur.close()
     return result
+
+
+def stream_query(query, args=(), fetch_size=DB_STREAM_FETCH_SIZE):
+    """
+    Yields the rows of a SELECT one at a time from a server-side (named)
+    cursor that fetches fetch_size rows per round trip, so the result is never
+    held in memory all at once. The pooled connection stays checked out until
+    the generator is exhausted or closed.
+    """
+    with pool.connection() as conn:
+        cur = conn.cursor(
+            name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor
+        )
+        cur.itersize = fetch_size
+        try:
+            with metrics.timed(
+                metrics.DB_QUERY_LATENCY, statement=_statement(query, conn)
+            ):
+                cur.execute(query, args)
+            yield from cur
+        finally:
+            cur.close()
+        # Read-only, so ending the transaction is all that is left to do
+        conn.rollback()
+
+
+class Transaction:
+    """
+    Runs several statements on one connection; see transaction().
+    """
+
+    def __init__(self, conn, cursor):
+        self.conn = conn
+        self.cursor = cursor
+
+    def query(self, query, args=(), one=False):
+        with metrics.timed(
+            metrics.DB_QUERY_LATENCY, statement=_statement(query, self.conn)
+        ):
+            self.cursor.execute(query, args)
+            if self.cursor.description is None:
+                return None
+            if one:
+                return self.cursor.fetchone()
+            return self.cursor.fetchall()
+
+    def bulk_insert(self, table, columns, rows, returning=None, page_size=500):
+        """
+        Inserts rows (sequences of values in columns order) with multi-row
+        VALUES statements. Returns the RETURNING rows, in input order, if
+        returning lists columns.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        statement = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+        )
+        if returning:
+            statement += sql.SQL(" RETURNING {}").format(
+                sql.SQL(", ").join(map(sql.Identifier, returning))
+            )
+        return psycopg2.extras.execute_values(
+            self.cursor,
+            statement.as_string(self.cursor),
+            rows,
+            page_size=page_size,
+            fetch=bool(returning),
+        ) or []
+
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: every statement run through the yielded Transaction shares
+    one connection and is committed together when the block exits, or rolled
+    back if it raises.
+
+        with transaction() as tx:
+            tx.query("DELETE FROM ...", (id,))
+            tx.bulk_insert("summaries", ["program_id", "summary"], rows)
+    """
+    with pool.connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            yield Transaction(conn, cur)
+        conn.commit()
+
+
+def bulk_insert(table, columns, rows, returning=None):
+    """bulk_insert() in a transaction of its own."""
+    with transaction() as tx:
+        return tx.bulk_insert(table, columns, rows, returning=returning)
@@ -2,66 +2,317 @@ import time
 import requests
 import os
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
+from . import judge_cache
+from . import metrics
+from . import profiler
 
 load_dotenv()
 
 BASE_URL = os.getenv("JUDGE_URL")
 SUBMISSION_URL = f"{BASE_URL}/submissions"
+BATCH_SUBMISSION_URL = f"{BASE_URL}/submissions/batch"
 GET_SUBMISSION_URL = lambda token: f"{BASE_URL}/submissions/{token}?base64_encoded=true"
+GET_BATCH_URL = (
+    lambda tokens: f"{BASE_URL}/submissions/batch?tokens={','.join(tokens)}&base64_encoded=true"
+)
+
+# Total seconds to wait for a submission to finish before giving up
+JUDGE_TIMEOUT = float(os.getenv("JUDGE_TIMEOUT", "20"))
+# Polling starts fast and backs off up to JUDGE_POLL_MAX between fetches
+JUDGE_POLL_INITIAL = float(os.getenv("JUDGE_POLL_INITIAL", "0.2"))
+JUDGE_POLL_MAX = float(os.getenv("JUDGE_POLL_MAX", "2"))
+JUDGE_POLL_BACKOFF = 1.5
+# Send all test inputs of a submission in one /submissions/batch request
+JUDGE_BATCH = os.getenv("JUDGE_BATCH", "false").lower() in ("1", "true", "yes")
+# Judge0 calls in flight across the whole process
+JUDGE_MAX_WORKERS = int(os.getenv("JUDGE_MAX_WORKERS", "16"))
+# Judge0 calls in flight for a single submission
+JUDGE_REQUEST_CONCURRENCY = int(os.getenv("JUDGE_REQUEST_CONCURRENCY", "4"))
+
+# Judge0 status ids 1 ("In Queue") and 2 ("Processing") are the only
+# non-terminal states
+PENDING_STATUSES = (1, 2)
 
 
 print(BASE_URL)
 
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=JUDGE_MAX_WORKERS, thread_name_prefix="judge"
+            )
+    return _executor
+
+
+def _request(method, operation, url, **kwargs):
+    """One HTTP round trip to Judge0, timed by operation."""
+    with metrics.timed(metrics.JUDGE_LATENCY, operation=operation):
+        return requests.request(method, url, **kwargs)
+
 
-def judge(code, input=None, language=50):
+def queue_depth():
+    """Number of test runs waiting for a free judge worker."""
+    with _executor_lock:
+        executor = _executor
+    # ThreadPoolExecutor keeps its backlog in _work_queue
+    return executor._work_queue.qsize() if executor is not None else 0
+
+
+def _decode(value):
+    if not value:
+        return ""
+    try:
+        return base64.b64decode(value).decode("utf-8")
+    except Exception:
+        return ""
+
+
+def _result(submission_data=None, error=None):
+    submission_data = submission_data or {}
+    compile_output = _decode(submission_data.get("compile_output"))
+    status = submission_data.get("status") or {}
+    return {
+        "stdout": _decode(submission_data.get("stdout")),
+        "stderr": _decode(submission_data.get("stderr")),
+        "compile_output": compile_output,
+        "compile_error": len(compile_output) > 0,
+        "status": status.get("description"),
+        "status_id": status.get("id"),
+        "time": submission_data.get("time"),
+        "memory": submission_data.get("memory"),
+        "error": error,
+    }
+
+
+def _is_pending(submission_data):
+    status = submission_data.get("status") or {}
+    return status.get("id") in PENDING_STATUSES
+
+
+def _poll(fetch, deadline):
+    """
+    Calls fetch() until it reports that it is done, sleeping with exponential
+    backoff between attempts. Returns False if the deadline passes first.
+    """
+    delay = JUDGE_POLL_INITIAL
+    while True:
+        if fetch():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * JUDGE_POLL_BACKOFF, JUDGE_POLL_MAX)
+
+
+def judge(code, input=None, language=50, timeout=JUDGE_TIMEOUT):
+    cached = judge_cache.get(code, input, language)
+    if cached is not None:
+        return cached
+
+    deadline = time.monotonic() + timeout
     data = {
         "source_code": code,
         "language_id": language,
         "stdin": input,
     }
 
-    response = requests.post(SUBMISSION_URL, json=data)
+    try:
+        response = _request("POST", "submit", SUBMISSION_URL, json=data, timeout=timeout)
+    except requests.RequestException as e:
+        return _result(error=f"Submission failed: {e}")
 
     if response.status_code < 300:
         token = response.json().get("token")
     else:
         print("Error submitting!:", response.text)
-        return None
+        return _result(error="Submission failed")
+
+    state = {}
+
+    def fetch():
+        try:
+            submission_response = _request(
+                "GET",
+                "fetch",
+                GET_SUBMISSION_URL(token),
+                timeout=max(deadline - time.monotonic(), 1),
+            )
+        except requests.RequestException:
+            # Transient; try again on the next poll
+            return False
+        if not submission_response.ok:
+            state["error"] = "Submission fetch failed"
+            return True
+        state["data"] = submission_response.json()
+        return not _is_pending(state["data"])
 
-    # Wait for the submission to be processed
-    time.sleep(3)
+    if not _poll(fetch, deadline):
+        return _result(state.get("data"), error="Timed out waiting for result")
+    result = _result(state.get("data"), error=state.get("error"))
+    judge_cache.put(code, input, language, result)
+    return result
 
-    submission_response = requests.get(GET_SUBMISSION_URL(token))
-    if not submission_response.ok:
-        return False, "Submission fetch failed", {}
 
-    submission_data = submission_response.json()
+def judge_batch(code, inputs, language=50, timeout=JUDGE_TIMEOUT):
+    """
+    Runs the same code against every stdin in inputs using a single Judge0
+    batch submission. Returns one result per input, in input order. Inputs
+    with a memoized result are not sent.
+    """
+    all_inputs = list(inputs)
+    all_results = [judge_cache.get(code, stdin, language) for stdin in all_inputs]
+    missing = [i for i, result in enumerate(all_results) if result is None]
+    if missing:
+        judged = _judge_batch(code, [all_inputs[i] for i in missing], language, timeout)
+        for i, result in zip(missing, judged):
+            judge_cache.put(code, all_inputs[i], language, result)
+            all_results[i] = result
+    return all_results
 
-    # Decode base64 stdout if present
-    stdout_b64 = submission_data.get("stdout")
-    stdout = None
-    if stdout_b64:
+
+def _judge_batch(code, inputs, language, timeout):
+    deadline = time.monotonic() + timeout
+    data = {
+        "submissions": [
+            {"source_code": code, "language_id": language, "stdin": stdin}
+            for stdin in inputs
+        ]
+    }
+
+    try:
+        response = _request(
+            "POST", "batch_submit", BATCH_SUBMISSION_URL, json=data, timeout=timeout
+        )
+    except requests.RequestException as e:
+        return [_result(error=f"Submission failed: {e}") for _ in inputs]
+    if response.status_code >= 300:
+        print("Error submitting batch!:", response.text)
+        return [_result(error="Submission failed") for _ in inputs]
+
+    # Each entry is either {"token": ...} or a per-submission validation error
+    entries = response.json()
+    tokens = [entry.get("token") for entry in entries]
+    results = [None] * len(inputs)
+    for i, token in enumerate(tokens):
+        if not token:
+            results[i] = _result(error=f"Submission rejected: {entries[i]}")
+
+    pending = {token: i for i, token in enumerate(tokens) if token}
+
+    def fetch():
         try:
-            stdout = base64.b64decode(stdout_b64).decode("utf-8")
-        except Exception as e:
-            stdout = ""
-    else:
-        stdout = ""
+            batch_response = _request(
+                "GET",
+                "batch_fetch",
+                GET_BATCH_URL(list(pending)),
+                timeout=max(deadline - time.monotonic(), 1),
+            )
+        except requests.RequestException:
+            # Transient; try again on the next poll
+            return False
+        if not batch_response.ok:
+            for i in pending.values():
+                results[i] = _result(error="Submission fetch failed")
+            pending.clear()
+            return True
+        for submission_data in batch_response.json().get("submissions", []):
+            token = submission_data.get("token")
+            if token in pending and not _is_pending(submission_data):
+                results[pending.pop(token)] = _result(submission_data)
+        return not pending
+
+    if pending and not _poll(fetch, deadline):
+        for i in pending.values():
+            results[i] = _result(error="Timed out waiting for result")
+    return results
+
+
+def judge_many(
+    code,
+    inputs,
+    language=50,
+    timeout=JUDGE_TIMEOUT,
+    max_parallel=JUDGE_REQUEST_CONCURRENCY,
+    on_result=None,
+):
+    """
+    Runs the same code against every stdin in inputs concurrently on the shared
+    judge worker pool, with at most max_parallel of them in flight at once.
+    Returns one result per input, in input order. An input that fails or does
+    not finish within timeout gets a result with its error field set instead of
+    failing the others.
 
-    # Decode base64 compile_output if present
-    compile_output_b64 = submission_data.get("compile_output")
-    compile_output = None
-    if compile_output_b64:
+    If given, on_result(index, result) is called once per input as soon as it
+    is judged, possibly from a worker thread. An input that finishes after it
+    was reported as timed out is not reported again.
+    """
+    callback = on_result or (lambda index, result: None)
+    reported = set()
+    reported_lock = threading.Lock()
+
+    def on_result(index, result):
+        with reported_lock:
+            if index in reported:
+                return
+            reported.add(index)
+        callback(index, result)
+
+    inputs = list(inputs)
+    deadline = time.monotonic() + timeout
+    slots = threading.BoundedSemaphore(max(max_parallel, 1))
+    executor = _get_executor()
+
+    @profiler.propagate
+    def run(index, stdin):
         try:
-            compile_output = base64.b64decode(compile_output_b64).decode("utf-8")
-        except Exception as e:
-            compile_output = ""
-    else:
-        compile_output = ""
+            result = judge(
+                code,
+                input=stdin,
+                language=language,
+                timeout=max(deadline - time.monotonic(), 0.1),
+            )
+        finally:
+            slots.release()
+        on_result(index, result)
+        return result
 
-    return {
-        "stdout": stdout,
-        "compile_output": compile_output,
-        "compile_error": len(compile_output) > 0,
-    }
+    futures = []
+    for index, stdin in enumerate(inputs):
+        if not slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            futures.append(None)
+            continue
+        futures.append(executor.submit(run, index, stdin))
+
+    results = []
+    for index, future in enumerate(futures):
+        if future is None:
+            result = _result(error="Timed out waiting for result")
+            on_result(index, result)
+            results.append(result)
+            continue
+        try:
+            # judge() enforces the deadline itself; the grace period only
+            # covers a request that is stuck in the network layer
+            results.append(
+                future.result(timeout=max(deadline - time.monotonic(), 0) + 1)
+            )
+        except FutureTimeout:
+            future.cancel()
+            result = _result(error="Timed out waiting for result")
+            on_result(index, result)
+            results.append(result)
+        except Exception as e:
+            result = _result(error=f"Judge failed: {e}")
+            on_result(index, result)
+            results.append(result)
+    return results
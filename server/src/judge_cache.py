@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import threading
+from dotenv import load_dotenv
+from .db import query_db
+from .utils import code_hash
+
+load_dotenv()
+
+JUDGE_CACHE_ENABLED = os.getenv("JUDGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Least recently used results beyond this many rows are dropped by evict(),
+# which the media sweeper runs and put() runs every JUDGE_CACHE_EVICT_EVERY inserts
+JUDGE_CACHE_MAX_ROWS = int(os.getenv("JUDGE_CACHE_MAX_ROWS", "50000"))
+JUDGE_CACHE_EVICT_EVERY = int(os.getenv("JUDGE_CACHE_EVICT_EVERY", "1000"))
+# A hit only writes last_used_at (and hits) back once it is this many seconds
+# old, so most lookups are a plain read
+JUDGE_CACHE_TOUCH_AFTER = int(os.getenv("JUDGE_CACHE_TOUCH_AFTER", "300"))
+
+# Only results that a rerun would reproduce are memoized: Accepted, Wrong
+# Answer and Compilation Error. Time limits, runtime errors and internal
+# errors can depend on load or undefined behaviour, so they always rerun.
+CACHEABLE_STATUSES = (3, 4, 6)
+
+# Inserts made by this process, to run evict() every JUDGE_CACHE_EVICT_EVERY
+_inserts = 0
+_inserts_lock = threading.Lock()
+
+
+def cache_key(code, stdin, language_id):
+    parts = json.dumps([code_hash(code), stdin, int(language_id)])
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+def get(code, stdin, language_id):
+    """Returns the memoized judge result for this run, or None."""
+    if not JUDGE_CACHE_ENABLED:
+        return None
+    key = cache_key(code, stdin, language_id)
+    try:
+        row = query_db(
+            """
+            SELECT result,
+                last_used_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS touch
+            FROM judge_cache WHERE cache_key = %s
+            """,
+            (JUDGE_CACHE_TOUCH_AFTER, key),
+            one=True,
+        )
+        if row and row["touch"]:
+            query_db(
+                """
+                UPDATE judge_cache SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE cache_key = %s RETURNING cache_key
+                """,
+                (key,),
+                commit=True,
+            )
+    except Exception as e:
+        print("Judge cache lookup failed:", e)
+        return None
+    return row["result"] if row else None
+
+
+def put(code, stdin, language_id, result):
+    if not JUDGE_CACHE_ENABLED:
+        return
+    if result.get("error") or result.get("status_id") not in CACHEABLE_STATUSES:
+        return
+    try:
+        query_db(
+            """
+            INSERT INTO judge_cache (cache_key, code_hash, language_id, result)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                result = EXCLUDED.result, last_used_at = CURRENT_TIMESTAMP
+            RETURNING cache_key
+            """,
+            (
+                cache_key(code, stdin, language_id),
+                code_hash(code),
+                int(language_id),
+                json.dumps(result),
+            ),
+            commit=True,
+        )
+    except Exception as e:
+        print("Judge cache store failed:", e)
+        return
+    global _inserts
+    with _inserts_lock:
+        _inserts += 1
+        due = JUDGE_CACHE_EVICT_EVERY > 0 and _inserts % JUDGE_CACHE_EVICT_EVERY == 0
+    if due:
+        try:
+            evict()
+        except Exception as e:
+            print("Judge cache eviction failed:", e)
+
+
+def evict(max_rows=JUDGE_CACHE_MAX_ROWS):
+    """Drops the least recently used results beyond max_rows. Returns how many."""
+    rows = query_db(
+        """
+        DELETE FROM judge_cache WHERE cache_key IN (
+            SELECT cache_key FROM judge_cache
+            ORDER BY last_used_at DESC OFFSET %s
+        ) RETURNING cache_key
+        """,
+        (max_rows,),
+        commit=True,
+    )
+    return len(rows)
@@ -0,0 +1,90 @@
+import os
+import hashlib
+from dotenv import load_dotenv
+from .db import query_db
+from .utils import code_hash
+
+load_dotenv()
+
+# Seconds a cached completion stays valid
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def cache_key(model, template_version, language, hashed_code):
+    parts = "\0".join((model, template_version, language, hashed_code))
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+def get(model, template_version, language, code):
+    """Returns the cached completion for this code, or None."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    key = cache_key(model, template_version, language, code_hash(code))
+    try:
+        row = query_db(
+            """
+            SELECT response FROM llm_cache
+            WHERE cache_key = %s AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+            """,
+            (key,),
+            one=True,
+        )
+    except Exception as e:
+        print("LLM cache lookup failed:", e)
+        return None
+    return row["response"] if row else None
+
+
+def put(model, template_version, language, code, response, ttl=LLM_CACHE_TTL):
+    if not LLM_CACHE_ENABLED:
+        return
+    hashed_code = code_hash(code)
+    key = cache_key(model, template_version, language, hashed_code)
+    try:
+        query_db(
+            """
+            INSERT INTO llm_cache (cache_key, model, template_version, language, code_hash, response, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (cache_key) DO UPDATE SET
+                response = EXCLUDED.response,
+                created_at = CURRENT_TIMESTAMP,
+                expires_at = EXCLUDED.expires_at
+            RETURNING cache_key
+            """,
+            (key, model, template_version, language, hashed_code, response, ttl),
+            commit=True,
+        )
+        # Drop expired entries while we are here
+        query_db(
+            "DELETE FROM llm_cache WHERE expires_at <= CURRENT_TIMESTAMP RETURNING cache_key",
+            commit=True,
+        )
+    except Exception as e:
+        print("LLM cache store failed:", e)
+
+
+def invalidate(code=None, model=None, template_version=None, language=None):
+    """
+    Deletes cached completions matching every given filter, e.g. all languages
+    for one piece of code. With no filters the whole cache is cleared.
+    Returns the number of entries removed.
+    """
+    conditions = []
+    args = []
+    for column, value in (
+        ("code_hash", code_hash(code) if code is not None else None),
+        ("model", model),
+        ("template_version", template_version),
+        ("language", language),
+    ):
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            args.append(value)
+    where = " AND ".join(conditions) or "TRUE"
+    rows = query_db(
+        f"DELETE FROM llm_cache WHERE {where} RETURNING cache_key",
+        tuple(args),
+        commit=True,
+    )
+    return len(rows)
@@ -0,0 +1,210 @@
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from flask import Blueprint, Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from . import profiler
+
+# Under gunicorn every worker writes its samples to files in this folder and
+# /metrics adds them up across workers (see gunicorn.conf.py)
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Request and dependency latencies, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, until the response (or first chunk) is ready",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Time to run a query through query_db or a transaction, once connected",
+    ["statement", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "Time of an OpenAI chat completion, until the last token for streams",
+    ["model", "stream", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+SPEECH_LATENCY = Histogram(
+    "speech_request_duration_seconds",
+    "Time of an Azure text-to-speech (tts) or speech-to-text (stt) call",
+    ["operation", "voice", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+JUDGE_LATENCY = Histogram(
+    "judge_request_duration_seconds",
+    "Time of a single HTTP round trip to Judge0",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Prompt size of a chat tutor request, in tokens",
+    ["model"],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+
+# Wait categories of the per-request profiler
+_PROFILE_CATEGORIES = {
+    DB_QUERY_LATENCY: "db",
+    LLM_LATENCY: "llm",
+    SPEECH_LATENCY: "speech",
+    JUDGE_LATENCY: "judge",
+}
+
+_WHITESPACE = re.compile(r"\s+")
+_statement_labels = {}
+_stats_sources = []
+_stats_lock = threading.Lock()
+
+
+def statement_label(query):
+    """
+    Returns the label a query's text is recorded under: the text with
+    whitespace collapsed, cut to 120 characters. Queries are parameterized,
+    so there is one label per query in the code.
+    """
+    label = _statement_labels.get(query)
+    if label is None:
+        label = _statement_labels[query] = _WHITESPACE.sub(" ", query).strip()[:120]
+    return label
+
+
+def observe(histogram, seconds, **labels):
+    """Records a latency, and adds it to the request's profile if there is one."""
+    histogram.labels(**labels).observe(seconds)
+    category = _PROFILE_CATEGORIES.get(histogram)
+    if category:
+        profiler.record(category, seconds)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observes the time spent in the block, with outcome ok or error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe(histogram, time.perf_counter() - start, outcome=outcome, **labels)
+
+
+def register_stats(prefix, source, label=None):
+    """
+    Exports the numbers source() returns as gauges named <prefix>_<key>,
+    read when /metrics is scraped. With label set, source() returns
+    {label value: {key: number}} instead. Values that are not numbers are
+    skipped.
+    """
+    with _stats_lock:
+        _stats_sources.append((prefix, source, label))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _StatsCollector:
+    def collect(self):
+        with _stats_lock:
+            sources = list(_stats_sources)
+        # Live state belongs to the worker serving the scrape
+        base_labels = {"pid": str(os.getpid())} if MULTIPROCESS else {}
+        for prefix, source, label in sources:
+            try:
+                stats = source()
+            except Exception as e:
+                print(f"Could not collect {prefix} stats:", e)
+                continue
+            rows = stats.items() if label else [(None, stats)]
+            families = {}
+            for label_value, values in rows:
+                labels = dict(base_labels)
+                if label:
+                    labels[label] = str(label_value)
+                for key, value in values.items():
+                    if not _is_number(value):
+                        continue
+                    name = f"{prefix}_{key}"
+                    if name not in families:
+                        families[name] = GaugeMetricFamily(
+                            name, f"{prefix} {key}", labels=list(labels)
+                        )
+                    families[name].add_metric(list(labels.values()), value)
+            yield from families.values()
+
+
+_stats_collector = _StatsCollector()
+
+
+def _registry():
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_stats_collector)
+    return registry
+
+
+if not MULTIPROCESS:
+    REGISTRY.register(_stats_collector)
+
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(error=None):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    rule = request.url_rule
+    REQUEST_LATENCY.labels(
+        route=rule.rule if rule is not None else "<unmatched>",
+        method=request.method,
+        status=str(g.pop("metrics_status", 500)),
+    ).observe(time.perf_counter() - start)
+
+
+def init_app(app):
+    """Records the latency of every request and serves /metrics."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(metrics_bp)
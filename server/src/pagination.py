@@ -0,0 +1,122 @@
+import os
+import json
+import base64
+import datetime
+from flask import request, jsonify
+import psycopg2
+from psycopg2 import sql
+from .db import query_db
+from .streaming import streamed, wants_stream
+
+# Page size when only a cursor is given, and the largest page a client may ask for
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(row, keys):
+    """Returns the opaque token pointing just past row."""
+    values = [_encode_value(row[key]) for key in keys]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise PaginationError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise PaginationError("Invalid cursor")
+    # Lists, objects and booleans fail in Postgres with errors other than the
+    # DataError that paginated() reports as an invalid cursor
+    if any(
+        isinstance(value, bool) or not isinstance(value, (str, int, float, type(None)))
+        for value in values
+    ):
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def page_args(keys):
+    """
+    Returns (limit, after) from the limit and after query parameters, or None
+    when the client asked for neither.
+    """
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    if limit is None and after is None:
+        return None
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PaginationError("limit must be an integer")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise PaginationError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit, decode_cursor(after, keys) if after else None
+
+
+def page_query(query, keys, after=False):
+    """
+    Wraps query so it returns the rows past a cursor in ascending keys order.
+    Its parameters are query's own, then the cursor values if after is set,
+    then the page size.
+    """
+    columns = sql.SQL(", ").join(sql.Identifier(key) for key in keys)
+    where = sql.SQL("")
+    if after:
+        where = sql.SQL("WHERE ({}) > ({})").format(
+            columns, sql.SQL(", ").join(sql.Placeholder() * len(keys))
+        )
+    return sql.SQL("SELECT * FROM ({}) AS page {} ORDER BY {} LIMIT %s").format(
+        sql.SQL(query), where, columns
+    )
+
+
+def fetch_page(query, args, keys, limit, after=None):
+    """
+    Returns (rows, next_cursor) for one page of query. The keys must be
+    columns of the query's result backed by an index, so each page is an
+    index range scan however deep the client pages.
+    """
+    args = list(args) + (after or [])
+    # One extra row tells whether there is a next page
+    rows = query_db(page_query(query, keys, after is not None), args + [limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1], keys)
+
+
+def paginated(query, args=(), keys=("id",)):
+    """
+    Responds with every row of query, as before, or with
+    {"items": [...], "next": cursor} when the request has limit or after
+    query parameters. next is null on the last page. With stream=1 and no
+    page parameters the full list is streamed from a server-side cursor.
+    """
+    try:
+        page = page_args(keys)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is None:
+        if wants_stream():
+            return streamed(query, args)
+        return jsonify(query_db(query, args))
+    try:
+        rows, next_cursor = fetch_page(query, args, keys, *page)
+    except psycopg2.DataError:
+        # The cursor values do not fit the sort columns
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({"items": rows, "next": next_cursor})
@@ -0,0 +1,282 @@
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import pstats
+import random
+import cProfile
+import threading
+import contextvars
+from io import StringIO
+from flask import Blueprint, abort, g, jsonify, request, send_from_directory
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Nothing is profiled unless this is set
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+# Requests carrying this value in the X-Profile header are profiled. It also
+# guards the /profiles endpoints, which are disabled while it is unset
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+# Fraction of all other requests to profile, e.g. 0.01
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+# Only the newest reports are kept
+PROFILER_MAX_REPORTS = int(os.getenv("PROFILER_MAX_REPORTS", "200"))
+# Functions listed in a report, by cumulative time
+PROFILER_TOP_FUNCTIONS = int(os.getenv("PROFILER_TOP_FUNCTIONS", "40"))
+
+WAIT_CATEGORIES = ("db", "llm", "speech", "judge")
+
+_current = contextvars.ContextVar("profile", default=None)
+_save_lock = threading.Lock()
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+
+
+class Profile:
+    """
+    Wall-clock breakdown of one request. Time spent waiting on the database,
+    the LLM, Azure speech and Judge0 is reported by metrics.observe(); CPU
+    time is thread time, so it excludes those waits. Work handed to other
+    threads through propagate() is reported separately, since it overlaps
+    with the request thread.
+    """
+
+    def __init__(self, request_id, route, method, path):
+        self.request_id = request_id
+        self.route = route
+        self.method = method
+        self.path = path
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._lock = threading.Lock()
+        self.waits = dict.fromkeys(WAIT_CATEGORIES, 0.0)
+        self.calls = dict.fromkeys(WAIT_CATEGORIES, 0)
+        self.background_waits = dict.fromkeys(WAIT_CATEGORIES, 0.0)
+        self.background_cpu = 0.0
+        self.profiler = None
+
+    def start_functions(self):
+        """Starts cProfile on the request thread, if no other profiler runs."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one cProfile per process at a time; the
+            # wall-clock breakdown does not depend on it
+            return
+        self.profiler = profiler
+
+    def stop_functions(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def add_wait(self, category, seconds):
+        background = threading.get_ident() != self.thread_id
+        with self._lock:
+            if background:
+                self.background_waits[category] += seconds
+            else:
+                self.waits[category] += seconds
+            self.calls[category] += 1
+
+    def add_background_cpu(self, seconds):
+        with self._lock:
+            self.background_cpu += seconds
+
+    def report(self, status):
+        wall = time.perf_counter() - self._start
+        cpu = time.thread_time() - self._cpu_start
+        waited = sum(self.waits.values())
+        stream = StringIO()
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(PROFILER_TOP_FUNCTIONS)
+        return {
+            "id": self.id,
+            "request_id": self.request_id,
+            "route": self.route,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started_at": self.started_at,
+            "wall": wall,
+            "breakdown": {
+                **self.waits,
+                "python_cpu": cpu,
+                # Waiting on anything else: worker threads, the pool, locks,
+                # the client, disk
+                "other": max(wall - waited - cpu, 0.0),
+            },
+            "calls": self.calls,
+            "background_threads": {
+                **self.background_waits,
+                "python_cpu": self.background_cpu,
+            },
+            "functions": stream.getvalue(),
+        }
+
+    @property
+    def id(self):
+        slug = _SLUG.sub("_", f"{self.method} {self.route}").strip("_")
+        return f"{int(self.started_at * 1000)}-{slug}-{self.request_id}"
+
+
+def current():
+    return _current.get()
+
+
+def record(category, seconds):
+    """Adds a wait to the profile of the current request, if it is profiled."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add_wait(category, seconds)
+
+
+def propagate(fn):
+    """
+    Wraps fn so it runs with the caller's context (and so counts towards the
+    caller's profile) when handed to another thread, e.g. an executor.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(_run_profiled, fn, args, kwargs)
+
+    return run
+
+
+def _run_profiled(fn, args, kwargs):
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    start = time.thread_time()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.add_background_cpu(time.thread_time() - start)
+
+
+def _authorized(value):
+    return bool(PROFILER_TOKEN) and hmac.compare_digest(value or "", PROFILER_TOKEN)
+
+
+def _should_profile():
+    if _authorized(request.headers.get("X-Profile")):
+        return True
+    return PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE
+
+
+def _save(report):
+    os.makedirs(PROFILER_DIR, exist_ok=True)
+    path = os.path.join(PROFILER_DIR, report["id"] + ".json")
+    with open(path + ".part", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".part", path)
+    with _save_lock:
+        reports = sorted(name for name in os.listdir(PROFILER_DIR) if name.endswith(".json"))
+        for name in reports[: max(len(reports) - PROFILER_MAX_REPORTS, 0)]:
+            try:
+                os.remove(os.path.join(PROFILER_DIR, name))
+            except OSError:
+                pass
+
+
+def _finish(profile, status):
+    profile.stop_functions()
+    _current.set(None)
+    try:
+        _save(profile.report(status))
+    except Exception as e:
+        print("Could not save profile:", e)
+
+
+def _before_request():
+    if not _should_profile():
+        return
+    rule = request.url_rule
+    profile = Profile(
+        request_id=_SLUG.sub("", request.headers.get("X-Request-ID", ""))[:64]
+        or uuid.uuid4().hex,
+        route=rule.rule if rule is not None else "<unmatched>",
+        method=request.method,
+        path=request.path,
+    )
+    g.profile = profile
+    _current.set(profile)
+    profile.start_functions()
+
+
+def _after_request(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    response.headers["X-Profile-Id"] = profile.id
+    if response.is_streamed:
+        # The body is generated after the view returns, so keep profiling
+        # until the server is done sending it
+        response.call_on_close(lambda: _finish(profile, response.status_code))
+    else:
+        _finish(profile, response.status_code)
+    return response
+
+
+def _teardown_request(error=None):
+    # Requests that failed before after_request ran
+    profile = g.pop("profile", None)
+    if profile is not None:
+        _finish(profile, 500)
+
+
+profiles_bp = Blueprint("profiles", __name__)
+
+
+@profiles_bp.before_request
+def _check_token():
+    if not _authorized(request.headers.get("X-Profile-Token")):
+        abort(403)
+
+
+@profiles_bp.route("/profiles", methods=["GET"])
+def list_profiles():
+    """Recent reports, newest first, without their function listings."""
+    if not os.path.isdir(PROFILER_DIR):
+        return jsonify([])
+    reports = []
+    for name in sorted(os.listdir(PROFILER_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILER_DIR, name)) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        report.pop("functions", None)
+        reports.append(report)
+    route = request.args.get("route")
+    if route:
+        reports = [report for report in reports if report["route"] == route]
+    return jsonify(reports)
+
+
+@profiles_bp.route("/profiles/<profile_id>", methods=["GET"])
+def download_profile(profile_id):
+    # send_from_directory refuses names that escape the folder
+    return send_from_directory(
+        os.path.abspath(PROFILER_DIR), profile_id + ".json", as_attachment=True
+    )
+
+
+def init_app(app):
+    """Profiles sampled or requested requests when PROFILER_ENABLED is set."""
+    if not PROFILER_ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(profiles_bp)
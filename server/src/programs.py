@@ -1,14 +1,19 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify
-from .db import query_db
+from .db import query_db, transaction
+from .pagination import paginated
 from .ai import summarize_code, synthesize_speech_to_unique_mp3
+from . import chat_cache
+from . import llm_cache
+from . import profiler
 
 programs_bp = Blueprint("programs", __name__)
 
 
 @programs_bp.route("/programs", methods=["GET"])
 def get_programs():
-    return jsonify(query_db("SELECT * FROM programs"))
+    return paginated("SELECT * FROM programs")
 
 
 @programs_bp.route("/programs/<int:id>", methods=["GET"])
@@ -23,11 +28,15 @@ def programs_by_class(class_id):
     return jsonify(query_db("SELECT * FROM programs WHERE class_id = %s", (class_id,)))
 
 
-def generate_and_save_summaries(program_id: int, code: str):
+def generate_and_save_summaries(program_id: int, code: str, refresh: bool = False):
     """
     Generates summaries and audio for all supported languages and saves them to the DB.
-    Removes old summaries first.
+    The languages are processed concurrently, and the old summaries are replaced
+    only once every language has succeeded. Summaries for unchanged code come
+    from the LLM cache unless refresh is set.
     """
+    if refresh:
+        llm_cache.invalidate(code=code)
 
     languages = [
         {
@@ -60,15 +69,8 @@ def generate_and_save_summaries(program_id: int, code: str):
         },
     ]
 
-    # Remove old summaries
-    query_db(
-        "DELETE FROM summaries WHERE program_id = %s RETURNING program_id",
-        (program_id,),
-        commit=True,
-    )
-
-    for language in languages:
-        # Generate summaries and audio for each language
+    def run_pipeline(language):
+        # Generate summaries and audio for one language
         summary_json = (
             summarize_code(code, language=language["language"])
             .replace("```json", "")
@@ -90,12 +92,20 @@ def generate_and_save_summaries(program_id: int, code: str):
             output_folder="media",
             voice=language["voice"],
         )
-
-        # Save the summary and audio to the database
-        query_db(
-            "INSERT INTO summaries (program_id, summary, audio_link, language, algorithm) VALUES (%s, %s, %s, %s, %s) RETURNING program_id",
-            (program_id, summary_text, audio_path, language["key"], algorithm_text),
-            commit=True,
+        return (program_id, summary_text, audio_path, language["key"], algorithm_text)
+
+    # Each language is independent, so run the pipelines side by side
+    with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+        rows = list(executor.map(profiler.propagate(run_pipeline), languages))
+
+    # Replace the old summaries in one transaction so readers never see a
+    # partial set
+    with transaction() as tx:
+        tx.query("DELETE FROM summaries WHERE program_id = %s", (program_id,))
+        tx.bulk_insert(
+            "summaries",
+            ["program_id", "summary", "audio_link", "language", "algorithm"],
+            rows,
         )
 
     # # Generate new summaries
@@ -170,6 +180,8 @@ def create_program():
     )
 
     id = row["id"]
+    # A request for the id before it existed may have cached it as empty
+    chat_cache.invalidate_program(id)
 
     try:
         generate_and_save_summaries(id, data["code"])
@@ -186,8 +198,13 @@ def regenerate_summaries(id):
     if not prog:
         return jsonify({"error": "Program not found"}), 404
 
+    # Also how code edited in the database reaches the chat tutor
+    chat_cache.invalidate_program(id)
+
+    # ?refresh=true discards cached summaries and asks the LLM again
+    refresh = request.args.get("refresh", "").lower() in ("1", "true", "yes")
     try:
-        generate_and_save_summaries(id, prog["code"])
+        generate_and_save_summaries(id, prog["code"], refresh=refresh)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -197,15 +214,9 @@ def regenerate_summaries(id):
 @programs_bp.route("/programs/<int:id>", methods=["DELETE"])
 def delete_program(id):
     # Optionally, delete related summaries and quizzes if needed
-    query_db(
-        "DELETE FROM summaries WHERE program_id = %s RETURNING program_id",
-        (id,),
-        commit=True,
-    )
-    query_db(
-        "DELETE FROM quizzes WHERE program_id = %s RETURNING program_id",
-        (id,),
-        commit=True,
-    )
-    query_db("DELETE FROM programs WHERE id = %s RETURNING id", (id,), commit=True)
+    with transaction() as tx:
+        tx.query("DELETE FROM summaries WHERE program_id = %s", (id,))
+        tx.query("DELETE FROM quizzes WHERE program_id = %s", (id,))
+        tx.query("DELETE FROM programs WHERE id = %s", (id,))
+    chat_cache.invalidate_program(id, messages=True)
     return jsonify({"status": "deleted", "id": id})
@@ -1,6 +1,7 @@
 import json
 from flask import Blueprint, request, jsonify
 from .db import query_db
+from .pagination import paginated
 
 quiz_bp = Blueprint("quiz", __name__)
 
@@ -57,17 +58,13 @@ def mark_answers():
 # View quizzes by class
 @quiz_bp.route("/quiz/class/<int:class_id>", methods=["GET"])
 def quizzes_by_class(class_id):
-    quizzes = query_db(
-        "SELECT * FROM quizzes WHERE class_id = %s",
-        (class_id,),
-    )
-    return jsonify(quizzes)
+    return paginated("SELECT * FROM quizzes WHERE class_id = %s", (class_id,))
 
 
 # View quizzes by program
 @quiz_bp.route("/quiz/program/<int:program_id>", methods=["GET"])
 def quizzes_by_program(program_id):
-    quizzes = query_db(
+    return paginated(
         """
         SELECT quizzes.*, users.username
         FROM quizzes
@@ -76,7 +73,6 @@ def quizzes_by_program(program_id):
         """,
         (program_id,),
     )
-    return jsonify(quizzes)
 
 
 # View quiz by program and user id
@@ -1,5 +1,6 @@
 import os
-from flask import Flask
+import io
+from flask import Flask, Request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 from .auth import auth_bp
@@ -11,10 +12,34 @@ from .summaries import summaries_bp
 from .users import users_bp
 from .audio import audio_bp
 from .chat import chat_bp
+from .db import pool
+from .sweeper import last_sweep, start_sweeper
+from . import chat_cache
+from . import speech
+from . import submissions
+from . import judge
+from . import metrics
+from . import profiler
+from . import tts_cache
+from .clients import openai_client
 
 load_dotenv()
 
+
+class InMemoryRequest(Request):
+    # Keep uploaded files in memory instead of spooling them to temp files;
+    # MAX_CONTENT_LENGTH bounds how large they can get
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return io.BytesIO()
+
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.getenv("MAX_CONTENT_LENGTH", str(16 * 1024 * 1024))
+)
 
 CORS(
     app,
@@ -23,6 +48,12 @@ CORS(
 )
 
 app.secret_key = os.getenv("SECRET_KEY")
+# Let a front proxy (nginx, Apache) send audio files itself via X-Sendfile
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
 
 
 @app.route("/")
@@ -30,6 +61,21 @@ def home():
     return "Flask server is running!"
 
 
+@app.route("/health/db")
+def db_health():
+    return jsonify(pool.stats())
+
+
+@app.route("/health/speech")
+def speech_health():
+    return jsonify(speech.stats())
+
+
+@app.route("/health/media")
+def media_health():
+    return jsonify(last_sweep())
+
+
 app.register_blueprint(auth_bp)
 app.register_blueprint(classrooms_bp)
 app.register_blueprint(programs_bp)
@@ -40,6 +86,49 @@ app.register_blueprint(users_bp)
 app.register_blueprint(audio_bp)
 app.register_blueprint(chat_bp)
 
+metrics.init_app(app)
+profiler.init_app(app)
+metrics.register_stats("db_pool", pool.stats)
+metrics.register_stats("chat_cache", chat_cache.stats, label="cache")
+metrics.register_stats("tts_cache", tts_cache.stats, label="folder")
+metrics.register_stats("speech_synthesizers", speech.synthesizers.stats, label="voice")
+metrics.register_stats("media_sweep", last_sweep)
+metrics.register_stats(
+    "executor",
+    lambda: {
+        "judge": {"queue_depth": judge.queue_depth()},
+        "submissions": {"queue_depth": submissions.queue_depth()},
+    },
+    label="pool",
+)
+
+
+# Comma separated voices whose synthesizers are opened when a worker starts
+WARM_SPEECH_VOICES = [
+    voice for voice in os.getenv("WARM_SPEECH_VOICES", "").split(",") if voice
+]
+
+
+def warm_worker():
+    """
+    Readies a freshly started worker before it takes requests: opens the
+    database pool's minimum connections, creates the OpenAI client and the
+    configured speech synthesizers, and starts the media sweeper (an advisory
+    lock keeps workers from sweeping at the same time).
+    """
+    try:
+        pool.warm()
+    except Exception as e:
+        print("Could not warm the database pool:", e)
+    openai_client()
+    try:
+        speech.synthesizers.warm(WARM_SPEECH_VOICES)
+    except Exception as e:
+        print("Could not warm the speech synthesizers:", e)
+    start_sweeper()
+
 
-def main():
-    app.run(debug=True, port=5051, host="0.0.0.0", threaded=True)
+def shutdown_worker():
+    """Lets background submission jobs finish, then closes idle connections."""
+    submissions.shutdown(wait=True)
+    pool.closeall()
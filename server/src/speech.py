@@ -0,0 +1,236 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from .clients import speechsdk
+from . import metrics
+
+load_dotenv()
+
+# Synthesizers kept per voice; each one serves one request at a time
+SPEECH_POOL_SIZE = int(os.getenv("SPEECH_POOL_SIZE", "2"))
+# Seconds to wait for a free synthesizer before giving up
+SPEECH_POOL_TIMEOUT = float(os.getenv("SPEECH_POOL_TIMEOUT", "30"))
+
+# Name of the SpeechSynthesisOutputFormat member used for all synthesized audio
+OUTPUT_FORMAT = "Audio16Khz32KBitRateMonoMp3"
+
+# Recognition locale for each chat language
+RECOGNITION_LANGUAGES = {
+    "en": "en-IN",
+    "ka": "kn-IN",
+    "fr": "fr-FR",
+    "de": "de-DE",
+}
+
+
+class SpeechError(Exception):
+    pass
+
+
+class LatencyStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            if not ok:
+                stats["errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: dict(
+                    stats,
+                    avg=stats["total"] / stats["count"] if stats["count"] else 0.0,
+                )
+                for name, stats in self._stats.items()
+            }
+
+
+synthesis_stats = LatencyStats()
+recognition_stats = LatencyStats()
+
+_config_lock = threading.Lock()
+_synthesis_configs = {}
+_recognition_configs = {}
+
+
+def _new_config():
+    # Credentials are read once per config rather than on every request
+    return speechsdk().SpeechConfig(
+        subscription=os.getenv("AZURE_SPEECH_KEY"), region=os.getenv("AZURE_REGION")
+    )
+
+
+def synthesis_config(voice):
+    with _config_lock:
+        if voice not in _synthesis_configs:
+            config = _new_config()
+            config.speech_synthesis_voice_name = voice
+            config.set_speech_synthesis_output_format(
+                getattr(speechsdk().SpeechSynthesisOutputFormat, OUTPUT_FORMAT)
+            )
+            _synthesis_configs[voice] = config
+        return _synthesis_configs[voice]
+
+
+def recognition_config(language):
+    with _config_lock:
+        if language not in _recognition_configs:
+            config = _new_config()
+            if language in RECOGNITION_LANGUAGES:
+                config.speech_recognition_language = RECOGNITION_LANGUAGES[language]
+            _recognition_configs[language] = config
+        return _recognition_configs[language]
+
+
+class SynthesizerPool:
+    """
+    Process-wide pool of pre-warmed SpeechSynthesizers, up to size per voice.
+    Synthesizers write to memory (no audio config), so one can be reused for
+    any number of requests as long as only one thread uses it at a time.
+    """
+
+    def __init__(self, size=SPEECH_POOL_SIZE, timeout=SPEECH_POOL_TIMEOUT):
+        self.size = max(size, 1)
+        self.timeout = timeout
+        # Notified whenever a synthesizer is returned or discarded, so waiters
+        # take the idle one or create a replacement
+        self._cond = threading.Condition()
+        self._idle = {}  # voice -> list of idle synthesizers
+        self._created = {}  # voice -> number of synthesizers created
+
+    def _new_synthesizer(self, voice):
+        sdk = speechsdk()
+        synthesizer = sdk.SpeechSynthesizer(
+            speech_config=synthesis_config(voice), audio_config=None
+        )
+        # Open the service connection now instead of on the first request
+        connection = sdk.Connection.from_speech_synthesizer(synthesizer)
+        connection.open(True)
+        return synthesizer
+
+    def _acquire(self, voice):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(voice, [])
+                if idle:
+                    return idle.pop()
+                if self._created.get(voice, 0) < self.size:
+                    self._created[voice] = self._created.get(voice, 0) + 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SpeechError(f"No synthesizer available for {voice}")
+                self._cond.wait(remaining)
+
+        # Connecting happens outside the lock
+        try:
+            return self._new_synthesizer(voice)
+        except Exception:
+            with self._cond:
+                self._created[voice] -= 1
+                self._cond.notify_all()
+            raise
+
+    def _release(self, voice, synthesizer, broken=False):
+        with self._cond:
+            if broken:
+                self._created[voice] -= 1
+            else:
+                self._idle[voice].append(synthesizer)
+            # Waiters may be for other voices, so wake them all
+            self._cond.notify_all()
+
+    def warm(self, voices):
+        """Creates one synthesizer per voice ahead of the first request."""
+        for voice in voices:
+            self._release(voice, self._acquire(voice))
+
+    def synthesize(self, text, voice):
+        """Returns the synthesized audio as bytes in OUTPUT_FORMAT."""
+        sdk = speechsdk()
+        start = time.monotonic()
+        synthesizer = self._acquire(voice)
+        broken = False
+        try:
+            result = synthesizer.speak_text_async(text).get()
+            if result.reason == sdk.ResultReason.SynthesizingAudioCompleted:
+                return result.audio_data
+            broken = True
+            details = result.cancellation_details
+            print(f"Speech synthesis canceled: {details.reason}")
+            if details.reason == sdk.CancellationReason.Error:
+                print(f"Error details: {details.error_details}")
+            raise SpeechError(f"Speech synthesis canceled: {details.reason}")
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(voice, synthesizer, broken=broken)
+            elapsed = time.monotonic() - start
+            synthesis_stats.record(voice, elapsed, ok=not broken)
+            metrics.observe(
+                metrics.SPEECH_LATENCY,
+                elapsed,
+                operation="tts",
+                voice=voice,
+                outcome="error" if broken else "ok",
+            )
+
+    def stats(self):
+        with self._cond:
+            return {
+                voice: {"created": created, "idle": len(self._idle[voice])}
+                for voice, created in self._created.items()
+            }
+
+
+synthesizers = SynthesizerPool()
+
+
+def synthesize(text, voice):
+    return synthesizers.synthesize(text, voice)
+
+
+def recognize(audio_config, language="en"):
+    """
+    Runs a single recognition on audio_config. Returns (text, error).
+    Recognizers are bound to their audio input, so only their config is shared.
+    """
+    sdk = speechsdk()
+    start = time.monotonic()
+    recognizer = sdk.SpeechRecognizer(
+        speech_config=recognition_config(language), audio_config=audio_config
+    )
+    result = recognizer.recognize_once()
+    ok = result.reason == sdk.ResultReason.RecognizedSpeech
+    elapsed = time.monotonic() - start
+    recognition_stats.record(language, elapsed, ok=ok)
+    metrics.observe(
+        metrics.SPEECH_LATENCY,
+        elapsed,
+        operation="stt",
+        voice=RECOGNITION_LANGUAGES.get(language, language),
+        outcome="ok" if ok else "error",
+    )
+    if not ok:
+        return None, f"Speech recognition failed: {result.reason}"
+    return result.text.strip(), None
+
+
+def stats():
+    return {
+        "pool": synthesizers.stats(),
+        "synthesis": synthesis_stats.snapshot(),
+        "recognition": recognition_stats.snapshot(),
+    }
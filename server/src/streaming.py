@@ -0,0 +1,51 @@
+from flask import Response, current_app, request
+from .db import stream_query
+
+# Encoded rows are sent in chunks of about this many bytes
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def wants_stream():
+    return request.args.get("stream", "").lower() in ("1", "true")
+
+
+def json_array_response(rows):
+    """
+    Responds with rows as a JSON array that is written as the rows arrive,
+    encoded the same way jsonify would encode them. The first row is fetched
+    before the response starts, so a failing query still gets an error status
+    instead of a truncated body.
+    """
+    dumps = current_app.json.dumps
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return Response("[]\n", mimetype="application/json")
+
+    def generate():
+        chunk = ["[", dumps(first)]
+        size = 0
+        for row in rows:
+            encoded = dumps(row)
+            chunk.append(",")
+            chunk.append(encoded)
+            size += len(encoded)
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+        chunk.append("]\n")
+        yield "".join(chunk)
+
+    response = Response(generate(), mimetype="application/json")
+    # Hands the database connection back even if the client goes away
+    # before the body is fully sent
+    if hasattr(rows, "close"):
+        response.call_on_close(rows.close)
+    return response
+
+
+def streamed(query, args=()):
+    """Runs query with a server-side cursor and streams the rows as JSON."""
+    return json_array_response(stream_query(query, args))
@@ -1,7 +1,12 @@
+import os
 import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify
-from .db import query_db
-from .judge import judge
+from .db import query_db, transaction
+from .pagination import paginated
+from .judge import judge_batch, judge_many, JUDGE_BATCH
 from .ai import generate_quiz
 
 submissions_bp = Blueprint("submissions", __name__)
@@ -19,7 +24,7 @@ def submission_for_program_user(pid, uid):
 
 @submissions_bp.route("/submissions/user/<int:uid>", methods=["GET"])
 def user_submissions(uid):
-    return jsonify(query_db("SELECT * FROM submissions WHERE student_id = %s", (uid,)))
+    return paginated("SELECT * FROM submissions WHERE student_id = %s", (uid,))
 
 
 languages = {
@@ -29,17 +34,65 @@ languages = {
     "de": "German",
 }
 
+# Background workers for POST /submissions?async=true
+SUBMISSION_WORKERS = int(os.getenv("SUBMISSION_WORKERS", "4"))
+# A queued or running job that has not been updated for this many seconds was
+# lost, e.g. because the process restarted. Running jobs are updated as they
+# progress, and queued ones whenever a job starts in the process holding them
+SUBMISSION_JOB_STALE_AFTER = int(os.getenv("SUBMISSION_JOB_STALE_AFTER", "600"))
 
-@submissions_bp.route("/submissions", methods=["POST"])
-def submit_code():
-    data = request.json
+_executor = None
+_executor_lock = threading.Lock()
+# Ids of jobs queued or running in this process
+_active = set()
+_active_lock = threading.Lock()
 
-    prog_row = query_db(
-        "SELECT code FROM programs WHERE id = %s", (data["program_id"],), one=True
-    )
-    if not prog_row:
-        return jsonify({"error": "Program not found"}), 404
-    actual_code = prog_row["code"]
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SUBMISSION_WORKERS, thread_name_prefix="submission"
+            )
+    return _executor
+
+
+def queue_depth():
+    """Number of background submissions waiting for a free worker."""
+    with _executor_lock:
+        executor = _executor
+    # ThreadPoolExecutor keeps its backlog in _work_queue
+    return executor._work_queue.qsize() if executor is not None else 0
+
+
+def shutdown(wait=True):
+    """Stops taking jobs and, if wait is set, lets running ones finish."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _format_result(stdin, results):
+    return {
+        "stdin": stdin,
+        "stdout": results.get("stdout", ""),
+        "stderr": results.get("stderr", ""),
+        "compile_output": results.get("compile_output", ""),
+        "status": results.get("status"),
+        "error": results.get("error"),
+    }
+
+
+def process_submission(data, actual_code, report=None):
+    """
+    Runs the submission pipeline: quiz generation, judging every test input and
+    saving the quiz and submission. report(stage, **fields) is called after each
+    step so callers can publish progress. Returns the response body.
+    """
+    report = report or (lambda stage, **fields: None)
 
     # Generate a quiz using the AI function
     quiz_res = generate_quiz(
@@ -55,50 +108,205 @@ def submit_code():
     test_inputs = quiz_json.get("test_inputs", [])
     quiz = quiz_json.get("quiz", [])
     answer_key = quiz_json.get("answer_key", {})
+    report("quiz_ready", quiz=quiz_json, test_inputs=test_inputs)
 
-    final_results = []
-    for input in test_inputs:
-        results = judge(code=data["code"], input=input, language=data["language_id"])
-        final_results.append(
-            {
-                "stdin": input,
-                "stdout": results.get("stdout", ""),
-                "stderr": results.get("stderr", ""),
-                "compile_output": results.get("compile_output", ""),
-            }
+    if JUDGE_BATCH:
+        judged = judge_batch(
+            code=data["code"], inputs=test_inputs, language=data["language_id"]
+        )
+    else:
+        judged = judge_many(
+            code=data["code"],
+            inputs=test_inputs,
+            language=data["language_id"],
+            on_result=lambda index, results: report(
+                "judging",
+                index=index,
+                result=_format_result(test_inputs[index], results),
+            ),
         )
 
-    quiz_insert = query_db(
-        "INSERT INTO quizzes (program_id, student_id, questions, answers) VALUES (%s, %s, %s, %s) RETURNING id",
-        (
-            data["program_id"],
-            data["user_id"],
-            json.dumps(quiz),
-            json.dumps(answer_key),
-        ),
-        one=True,
+    final_results = [
+        _format_result(input, results) for input, results in zip(test_inputs, judged)
+    ]
+    report("judged", results=final_results)
+
+    # The quiz and the submission are saved together or not at all
+    with transaction() as tx:
+        quiz_insert = tx.query(
+            "INSERT INTO quizzes (program_id, student_id, questions, answers) VALUES (%s, %s, %s, %s) RETURNING id",
+            (
+                data["program_id"],
+                data["user_id"],
+                json.dumps(quiz),
+                json.dumps(answer_key),
+            ),
+            one=True,
+        )
+        quiz_id = quiz_insert.get("id")
+
+        # Insert submission into database
+        row = tx.query(
+            "INSERT INTO submissions (program_id, student_id, code, has_error, feedback) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (
+                data["program_id"],
+                data["user_id"],
+                data["code"],
+                not code_correct,
+                json.dumps(code_errors),
+            ),
+            one=True,
+        )
+    report("persisted", id=row["id"], quiz_id=quiz_id)
+    return {
+        "id": row["id"],
+        "results": final_results,
+        "quiz": quiz_json,
+        "quiz_id": quiz_id,
+    }
+
+
+def _save_job(job_id, status, stage, result, error=None):
+    query_db(
+        """
+        UPDATE submission_jobs
+        SET status = %s, stage = %s, result = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s RETURNING id
+        """,
+        (status, stage, json.dumps(result), error, job_id),
         commit=True,
     )
-    quiz_id = quiz_insert.get("id")
-
-    # Insert submission into database
-    row = query_db(
-        "INSERT INTO submissions (program_id, student_id, code, has_error, feedback) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-        (
-            data["program_id"],
-            data["user_id"],
-            data["code"],
-            not code_correct,
-            json.dumps(code_errors),
-        ),
-        one=True,
+
+
+def _touch_queued():
+    """
+    Marks the jobs still waiting for a worker in this process as alive, so a
+    backlog is not reported as interrupted while its queue makes progress.
+    """
+    with _active_lock:
+        waiting = list(_active)
+    if not waiting:
+        return
+    try:
+        query_db(
+            """
+            UPDATE submission_jobs SET updated_at = CURRENT_TIMESTAMP
+            WHERE id = ANY(%s) AND status = 'queued' RETURNING id
+            """,
+            (waiting,),
+            commit=True,
+        )
+    except Exception as e:
+        # Only affects how the waiting jobs look to other workers
+        print("Could not update queued submission jobs:", e)
+
+
+def _run_job(job_id, data, actual_code):
+    lock = threading.Lock()
+    result = {"quiz": None, "quiz_id": None, "id": None, "results": []}
+    state = {"stage": "started"}
+
+    def report(stage, **fields):
+        with lock:
+            if stage == "judging" and state["stage"] not in ("quiz_ready", "judging"):
+                # A timed-out input finished after the job moved on
+                return
+            if stage == "quiz_ready":
+                result["quiz"] = fields["quiz"]
+                result["results"] = [None] * len(fields["test_inputs"])
+            elif stage == "judging":
+                result["results"][fields["index"]] = fields["result"]
+            elif stage == "judged":
+                result["results"] = fields["results"]
+            elif stage == "persisted":
+                result["id"] = fields["id"]
+                result["quiz_id"] = fields["quiz_id"]
+            state["stage"] = stage
+            _save_job(job_id, "running", stage, result)
+
+    try:
+        _save_job(job_id, "running", "started", result)
+        _touch_queued()
+        process_submission(data, actual_code, report=report)
+        with lock:
+            _save_job(job_id, "done", state["stage"], result)
+    except Exception as e:
+        print("Submission job failed:", job_id, e)
+        with lock:
+            _save_job(job_id, "failed", state["stage"], result, error=str(e))
+    finally:
+        with _active_lock:
+            _active.discard(job_id)
+
+
+@submissions_bp.route("/submissions", methods=["POST"])
+def submit_code():
+    """
+    Checks a submission, generates its quiz and runs its test inputs.
+    With ?async=true (or "async": true in the body) the work is queued instead
+    and the response is a job id to poll at /submissions/jobs/<id>.
+    """
+    data = request.json
+
+    prog_row = query_db(
+        "SELECT code FROM programs WHERE id = %s", (data["program_id"],), one=True
+    )
+    if not prog_row:
+        return jsonify({"error": "Program not found"}), 404
+    actual_code = prog_row["code"]
+
+    run_async = request.args.get("async", str(data.get("async", ""))).lower()
+    if run_async not in ("1", "true", "yes"):
+        return jsonify(process_submission(data, actual_code))
+
+    job_id = str(uuid.uuid4())
+    query_db(
+        "INSERT INTO submission_jobs (id, student_id, program_id, payload) VALUES (%s, %s, %s, %s) RETURNING id",
+        (job_id, data["user_id"], data["program_id"], json.dumps(data)),
         commit=True,
     )
-    return jsonify(
-        {
-            "id": row["id"],
-            "results": final_results,
-            "quiz": quiz_json,
-            "quiz_id": quiz_id,
-        }
+    with _active_lock:
+        _active.add(job_id)
+    try:
+        _get_executor().submit(_run_job, job_id, data, actual_code)
+    except Exception:
+        with _active_lock:
+            _active.discard(job_id)
+        raise
+    return (
+        jsonify(
+            {
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/submissions/jobs/{job_id}",
+            }
+        ),
+        202,
+    )
+
+
+@submissions_bp.route("/submissions/jobs/<job_id>", methods=["GET"])
+def submission_job(job_id):
+    """
+    Returns the status of a background submission. result is filled in as the
+    job goes through its stages: quiz_ready, judging (one update per test
+    input), judged and persisted.
+    """
+    job = query_db(
+        """
+        SELECT id, student_id, program_id, status, stage, result, error,
+            created_at, updated_at,
+            updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS stale
+        FROM submission_jobs WHERE id = %s
+        """,
+        (SUBMISSION_JOB_STALE_AFTER, job_id),
+        one=True,
     )
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    with _active_lock:
+        held = job_id in _active
+    if job.pop("stale") and not held and job["status"] in ("queued", "running"):
+        job["status"] = "failed"
+        job["error"] = "Job was interrupted"
+    return jsonify(job)
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import threading
+from dotenv import load_dotenv
+from .db import get_db, query_db
+from . import judge_cache
+
+load_dotenv()
+
+MEDIA_DIR = "media"
+TEMP_DIR = "temp"
+
+# Seconds between sweeps of the background thread; 0 disables it
+MEDIA_SWEEP_INTERVAL = int(os.getenv("MEDIA_SWEEP_INTERVAL", "3600"))
+# Files younger than this are never touched, so in-flight uploads and
+# syntheses that are not referenced yet survive
+MEDIA_SWEEP_GRACE = int(os.getenv("MEDIA_SWEEP_GRACE", "600"))
+TEMP_MAX_AGE = int(os.getenv("TEMP_MAX_AGE", str(24 * 3600)))
+TEMP_MAX_BYTES = int(os.getenv("TEMP_MAX_BYTES", str(1024 * 1024 * 1024)))
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+
+# Arbitrary key for pg_try_advisory_lock so only one process sweeps at a time
+SWEEP_LOCK_ID = 72010511
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def referenced_paths():
+    """Returns the normalized paths of every file the database links to."""
+    rows = query_db(
+        """
+        SELECT audio_link AS path FROM summaries WHERE audio_link IS NOT NULL
+        UNION
+        SELECT audio_link FROM messages WHERE audio_link IS NOT NULL
+        UNION
+        SELECT content FROM messages WHERE "from" = 'student' AND content LIKE %s
+        """,
+        (TEMP_DIR + "/%",),
+    )
+    return {os.path.normpath(row["path"]) for row in rows}
+
+
+def _remove(entry, stats):
+    try:
+        os.remove(entry["path"])
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {entry['path']}: {e}")
+        return False
+    stats["files_removed"] += 1
+    stats["bytes_reclaimed"] += entry["size"]
+    return True
+
+
+def sweep_dir(folder, referenced, max_bytes, max_age=None, keep_referenced=True):
+    """
+    Removes unreferenced files from folder, then files older than max_age, then
+    the oldest files until the folder fits in max_bytes. Referenced files are
+    only removed when keep_referenced is False. Files younger than the grace
+    period are always kept.
+    """
+    start = time.monotonic()
+    now = time.time()
+    stats = {
+        "files_scanned": 0,
+        "files_removed": 0,
+        "bytes_reclaimed": 0,
+        "bytes_remaining": 0,
+        "over_quota": False,
+    }
+    if not os.path.isdir(folder):
+        stats["scan_seconds"] = time.monotonic() - start
+        return stats
+
+    entries = []
+    for dir_entry in os.scandir(folder):
+        if not dir_entry.is_file():
+            continue
+        stat = dir_entry.stat()
+        entries.append(
+            {
+                "path": dir_entry.path,
+                "size": stat.st_size,
+                "age": now - stat.st_mtime,
+                "referenced": os.path.normpath(dir_entry.path) in referenced,
+            }
+        )
+    stats["files_scanned"] = len(entries)
+
+    kept = []
+    for entry in entries:
+        removable = entry["age"] > MEDIA_SWEEP_GRACE and not (
+            keep_referenced and entry["referenced"]
+        )
+        expired = max_age is not None and entry["age"] > max_age
+        if removable and (not entry["referenced"] or expired):
+            if _remove(entry, stats):
+                continue
+        kept.append(entry)
+
+    total = sum(entry["size"] for entry in kept)
+    if total > max_bytes:
+        # Oldest first
+        for entry in sorted(kept, key=lambda entry: -entry["age"]):
+            if total <= max_bytes:
+                break
+            if entry["age"] <= MEDIA_SWEEP_GRACE:
+                continue
+            if keep_referenced and entry["referenced"]:
+                continue
+            if _remove(entry, stats):
+                total -= entry["size"]
+    stats["bytes_remaining"] = total
+    stats["over_quota"] = total > max_bytes
+    if stats["over_quota"]:
+        print(f"{folder} is over its {max_bytes} byte quota ({total} bytes in use)")
+    stats["scan_seconds"] = time.monotonic() - start
+    return stats
+
+
+def sweep():
+    """
+    Runs one sweep of temp/ and media/. Returns the stats, or None if another
+    process is already sweeping.
+    """
+    start = time.monotonic()
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", (SWEEP_LOCK_ID,))
+            locked = cur.fetchone()["locked"]
+        conn.commit()
+        if not locked:
+            return None
+        try:
+            referenced = referenced_paths()
+            # temp/ holds scratch recordings, so old files go even if a
+            # message still names them; media/ files that are linked stay
+            temp_stats = sweep_dir(
+                TEMP_DIR,
+                referenced,
+                TEMP_MAX_BYTES,
+                max_age=TEMP_MAX_AGE,
+                keep_referenced=False,
+            )
+            media_stats = sweep_dir(MEDIA_DIR, referenced, MEDIA_MAX_BYTES)
+            # Trimmed here rather than on every insert, which would sort the
+            # table on the judging path
+            try:
+                judge_evicted = judge_cache.evict()
+            except Exception as e:
+                print("Judge cache eviction failed:", e)
+                judge_evicted = 0
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SWEEP_LOCK_ID,))
+            conn.commit()
+
+    stats = {
+        "temp": temp_stats,
+        "media": media_stats,
+        "bytes_reclaimed": temp_stats["bytes_reclaimed"] + media_stats["bytes_reclaimed"],
+        "files_removed": temp_stats["files_removed"] + media_stats["files_removed"],
+        "judge_cache_evicted": judge_evicted,
+        "scan_seconds": time.monotonic() - start,
+        "finished_at": time.time(),
+    }
+    _save_last_sweep(stats)
+    print(
+        f"Media sweep removed {stats['files_removed']} files, "
+        f"reclaimed {stats['bytes_reclaimed']} bytes in {stats['scan_seconds']:.2f}s"
+    )
+    return stats
+
+
+def _save_last_sweep(stats):
+    try:
+        query_db(
+            """
+            INSERT INTO media_sweep (id, stats) VALUES (TRUE, %s)
+            ON CONFLICT (id) DO UPDATE SET
+                stats = EXCLUDED.stats, finished_at = CURRENT_TIMESTAMP
+            RETURNING id
+            """,
+            (json.dumps(stats),),
+            commit=True,
+        )
+    except Exception as e:
+        print("Could not save media sweep stats:", e)
+
+
+def last_sweep():
+    """
+    Stats of the last sweep run by any process, as sweep() returned them,
+    or {} if there has been none.
+    """
+    try:
+        row = query_db("SELECT stats FROM media_sweep WHERE id = TRUE", one=True)
+    except Exception as e:
+        print("Could not read media sweep stats:", e)
+        return {}
+    return row["stats"] if row else {}
+
+
+def _run_forever(interval):
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            print("Media sweep failed:", e)
+        time.sleep(interval)
+
+
+def start_sweeper(interval=MEDIA_SWEEP_INTERVAL):
+    """Starts the background sweeper thread once per process."""
+    global _thread
+    if interval <= 0:
+        return
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(
+            target=_run_forever, args=(interval,), name="media-sweeper", daemon=True
+        )
+        _thread.start()
+
+
+if __name__ == "__main__":
+    # One-off sweep, e.g. from cron: python -m src.sweeper
+    print(sweep())
@@ -0,0 +1,186 @@
+import os
+import re
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from .db import query_db
+
+load_dotenv()
+
+# Total size of cached audio kept per folder before the least recently used
+# files are evicted
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+CACHED_NAME = re.compile(r"^[0-9a-f]{64}\.mp3$")
+
+
+def cache_key(text: str, voice: str, output_format: str) -> str:
+    digest = hashlib.sha256()
+    for part in (output_format, voice, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _is_referenced(path):
+    row = query_db(
+        """
+        SELECT EXISTS (SELECT 1 FROM summaries WHERE audio_link = %s)
+            OR EXISTS (SELECT 1 FROM messages WHERE audio_link = %s) AS referenced
+        """,
+        (path, path),
+        one=True,
+    )
+    return bool(row and row["referenced"])
+
+
+class AudioCache:
+    """
+    Content-addressed cache of synthesized audio files.
+
+    Files are named after the hash of (output format, voice, text), so the same
+    request always maps to the same file. The index is rebuilt from the folder
+    on first use, ordered by modification time, and hits refresh that time so
+    recency survives restarts. Evicted files are only deleted from disk when no
+    summary or message links to them.
+    """
+
+    def __init__(self, folder, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None  # key -> size in bytes, least recently used first
+        self._bytes = 0
+        self._inflight = {}  # key -> lock held while the key is synthesized
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        # Called with the lock held
+        if self._index is not None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and CACHED_NAME.match(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._bytes = sum(self._index.values())
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f"{key}.mp3")
+
+    def _lookup(self, key):
+        # Called with the lock held
+        if key not in self._index:
+            return None
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            # Removed behind our back, e.g. by the media sweeper
+            self._bytes -= self._index.pop(key)
+            return None
+        self._index.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def _evict(self):
+        # Called with the lock held; returns paths to remove outside of it
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            evicted.append(self.path_for(key))
+        return evicted
+
+    def get_or_synthesize(self, text, voice, output_format, synthesize):
+        """
+        Returns the path of the cached audio for (text, voice, output_format).
+        On a miss, synthesize(path) is called to write the file and must return
+        True on success. Returns "" if synthesis fails.
+        """
+        key = cache_key(text, voice, output_format)
+        with self._lock:
+            self._load()
+            path = self._lookup(key)
+            if path:
+                self.hits += 1
+                return path
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+
+        # Only one thread synthesizes a given key; the others wait for it
+        with key_lock:
+            with self._lock:
+                path = self._lookup(key)
+                if path:
+                    self.hits += 1
+                    return path
+                self.misses += 1
+
+            path = self.path_for(key)
+            # Write to a temporary name so readers never see a partial file
+            temp_path = os.path.join(self.folder, f".{uuid.uuid4()}.mp3.part")
+            ok = False
+            evicted = []
+            try:
+                ok = synthesize(temp_path)
+                if ok:
+                    os.replace(temp_path, path)
+                    size = os.path.getsize(path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                with self._lock:
+                    if ok:
+                        self._bytes += size - self._index.pop(key, 0)
+                        self._index[key] = size
+                        evicted = self._evict()
+                    self._inflight.pop(key, None)
+            if not ok:
+                return ""
+
+        for evicted_path in evicted:
+            try:
+                if not _is_referenced(evicted_path):
+                    os.remove(evicted_path)
+            except Exception as e:
+                print(f"Could not evict {evicted_path}: {e}")
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index or {}),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(folder: str = "media") -> AudioCache:
+    with _caches_lock:
+        if folder not in _caches:
+            _caches[folder] = AudioCache(folder)
+        return _caches[folder]
+
+
+def stats():
+    """AudioCache.stats() of every cache folder in use."""
+    with _caches_lock:
+        caches = dict(_caches)
+    return {folder: cache.stats() for folder, cache in caches.items()}
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, request
 from .db import query_db
+from .pagination import paginated
 from .utils import hash_password, verify_password
 
 users_bp = Blueprint("users", __name__)
@@ -7,7 +8,7 @@ users_bp = Blueprint("users", __name__)
 
 @users_bp.route("/users", methods=["GET"])
 def all_users():
-    return jsonify(query_db("SELECT id, username, role FROM users"))
+    return paginated("SELECT id, username, role FROM users")
 
 
 @users_bp.route("/users/<int:user_id>", methods=["GET"])
@@ -1,3 +1,4 @@
+import hashlib
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -7,3 +8,16 @@ def hash_password(password):
 
 def verify_password(password, hashed):
     return check_password_hash(hashed, password)
+
+
+def normalize_code(code):
+    """
+    Normalizes source code for hashing: unifies line endings, strips trailing
+    whitespace and surrounding blank lines. Indentation is left alone.
+    """
+    lines = (code or "").replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def code_hash(code):
+    return hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()